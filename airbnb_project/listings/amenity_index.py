@@ -0,0 +1,137 @@
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .cache import data_version
+from .models import Amenity, Listing, ListingAmenity
+
+# Listings re-read on every refresh beyond the last one, so rows committed
+# late by a long scraper batch are not missed
+SYNC_OVERLAP = timedelta(minutes=5)
+# Most matches handed to the database as an id list; below the 999 bound
+# parameters older SQLite builds allow, and a short statement for MySQL
+MAX_ID_FILTER = 900
+
+
+def iter_bits(value):
+    """Positions of the set bits of `value`, lowest first."""
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'little')
+    for offset, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield offset * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+def bitmap(positions):
+    data = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+class AmenityIndex:
+    """
+    Inverted bitmap index over Listing.amenity_bits: one int per amenity
+    with bit p set when the listing at position p has it. An AND or OR of
+    a few amenities is then a handful of big-int operations, however many
+    listings there are.
+    """
+
+    def __init__(self):
+        self.listing_ids = []
+        self.positions = {}
+        self.listing_bits = {}
+        self.bitmaps = {}
+
+    def update(self, rows):
+        """Apply (listing id, amenity_bits) rows, new or changed."""
+        added = defaultdict(list)
+        removed = defaultdict(list)
+        for listing_id, raw in rows:
+            bits = int.from_bytes(bytes(raw or b''), 'little')
+            old = self.listing_bits.get(listing_id, 0)
+            if bits == old:
+                continue
+
+            position = self.positions.get(listing_id)
+            if position is None:
+                position = self.positions[listing_id] = len(self.listing_ids)
+                self.listing_ids.append(listing_id)
+            for amenity_id in iter_bits(bits & ~old):
+                added[amenity_id].append(position)
+            for amenity_id in iter_bits(old & ~bits):
+                removed[amenity_id].append(position)
+            self.listing_bits[listing_id] = bits
+
+        for amenity_id, positions in added.items():
+            self.bitmaps[amenity_id] = self.bitmaps.get(amenity_id, 0) | bitmap(positions)
+        for amenity_id, positions in removed.items():
+            self.bitmaps[amenity_id] &= ~bitmap(positions)
+
+    def combined(self, amenity_ids, match_all=True):
+        """Bitmap of the listings with all (or any) of `amenity_ids`."""
+        bitmaps = [self.bitmaps.get(amenity_id, 0) for amenity_id in amenity_ids]
+        if not bitmaps:
+            return 0
+        result = bitmaps[0]
+        for other in bitmaps[1:]:
+            result = result & other if match_all else result | other
+        return result
+
+    def ids(self, bitmap):
+        """Ids of the listings at the set positions of `bitmap`."""
+        return [self.listing_ids[position] for position in iter_bits(bitmap)]
+
+
+_index = AmenityIndex()
+_state = {'version': None, 'synced_at': None}
+_lock = threading.Lock()
+
+
+def get_amenity_index():
+    """
+    The process-wide index, brought up to date when the data version has
+    moved. The first call reads every listing; later ones only the listings
+    updated since the previous refresh.
+    """
+    version = data_version()
+    with _lock:
+        if _state['version'] != version:
+            started = timezone.now()
+            queryset = Listing.objects.all()
+            if _state['synced_at'] is not None:
+                queryset = queryset.filter(updated_at__gte=_state['synced_at'])
+            _index.update(queryset.values_list('id', 'amenity_bits').iterator(chunk_size=10000))
+            _state['version'] = version
+            _state['synced_at'] = started - SYNC_OVERLAP
+    return _index
+
+
+def filter_amenities(queryset, names, match_all=True):
+    """
+    Listings with all (or any) of the amenities called `names`. The bitmap
+    index says how many listings match; a few are filtered by id, more by
+    an indexed listing_amenities lookup per candidate row, so the statement
+    stays small however common the amenities are.
+    """
+    amenity_ids = sorted(set(
+        Amenity.objects.filter(name__in=names).values_list('id', flat=True)))
+    if match_all and len(amenity_ids) < len(set(names)):
+        # An amenity nobody has
+        return queryset.none()
+
+    index = get_amenity_index()
+    matches = index.combined(amenity_ids, match_all)
+    if matches.bit_count() <= MAX_ID_FILTER:
+        return queryset.filter(id__in=index.ids(matches))
+
+    links = ListingAmenity.objects.filter(listing=OuterRef('pk'))
+    if not match_all:
+        return queryset.filter(Exists(links.filter(amenity_id__in=amenity_ids)))
+    for amenity_id in amenity_ids:
+        queryset = queryset.filter(Exists(links.filter(amenity_id=amenity_id)))
+    return queryset
@@ -0,0 +1,67 @@
+from collections import defaultdict
+
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from airbnb_scraper.db import night_masks
+
+from .models import DataVersion, Listing, ListingAvailability
+from .search import get_search_backend
+
+# Longest stay ?check_in=/?check_out= may span
+MAX_NIGHTS = 90
+# Every night of a month; ListingAvailability.days never sets a higher bit
+ALL_NIGHTS = (1 << 31) - 1
+
+
+def filter_available(queryset, check_in, check_out):
+    """
+    Listings free for every night of the stay: one indexed lookup per
+    calendar month the stay touches.
+    """
+    for month, mask in night_masks(check_in, check_out).items():
+        available = (ListingAvailability.objects.filter(month=month)
+                     .alias(free=F('days').bitand(mask)).filter(free=mask)
+                     .values('listing_id'))
+        queryset = queryset.filter(id__in=available)
+    return queryset
+
+
+def settle_searched_nights(searches, observed_at):
+    """
+    Drop the nights a finished crawl searched but did not find free.
+    `searches` are the (location, check_in, check_out, guests) searches the
+    crawl that started at `observed_at` ran to the end. In each searched
+    window, the location's listings keep only the nights that crawl found
+    them free, so listings it no longer returned lose the window. Listings
+    not known to take that many guests, which the search could not have
+    returned, and rows a later crawl has written are left alone. Returns
+    the number of rows settled.
+    """
+    masks = defaultdict(int)
+    for location, check_in, check_out, guests in searches:
+        for month, mask in night_masks(check_in, check_out).items():
+            masks[(location, guests, month)] |= mask
+
+    backend = get_search_backend()
+    settled = 0
+    for (location, guests, month), mask in sorted(masks.items()):
+        listings = backend.filter_location(
+            Listing.objects.filter(max_guests__gte=guests), location).values('id')
+        rows = ListingAvailability.objects.filter(
+            Q(observed_at__isnull=True) | Q(observed_at__lte=observed_at),
+            listing__in=listings, month=month)
+        kept = F('days').bitand(ALL_NIGHTS & ~mask)
+        same_crawl = Q(observed_at=observed_at)
+        # MySQL assigns left to right: observed_at last, after the columns
+        # that compare against its old value
+        settled += rows.update(
+            days=Case(When(same_crawl, then=kept.bitor(F('observed_days').bitand(mask))),
+                      default=kept),
+            observed_days=Case(When(same_crawl, then=F('observed_days')), default=Value(0)),
+            observed_at=observed_at,
+            updated_at=timezone.now(),
+        )
+    if settled:
+        DataVersion.bump()
+    return settled
@@ -0,0 +1,112 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import DataVersion
+
+CACHE_ALIAS = getattr(settings, 'LISTINGS_CACHE_ALIAS', 'default')
+CACHE_TIMEOUT = getattr(settings, 'LISTINGS_CACHE_TIMEOUT', 3600)
+# How long a process trusts the data version it last read
+VERSION_TTL = getattr(settings, 'LISTINGS_DATA_VERSION_TTL', 5)
+
+METRICS = ('hits', 'misses', 'not_modified')
+
+_version = {'value': None, 'expires': 0.0}
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def data_version():
+    """
+    Counter bumped by the scraper whenever it commits listing changes.
+    Every cache key includes it, so a new crawl invalidates everything.
+    """
+    now = time.monotonic()
+    if _version['value'] is None or now >= _version['expires']:
+        _version['value'] = DataVersion.objects.filter(pk=1).values_list(
+            'version', flat=True).first() or 0
+        _version['expires'] = now + VERSION_TTL
+    return _version['value']
+
+
+def forget_data_version():
+    """Make the next data_version() call read the counter again."""
+    _version['value'] = None
+
+
+def cache_key(request, *parts):
+    # Repeated parameters keep their order; distinct ones are sorted so
+    # equivalent URLs share an entry
+    params = sorted((key, tuple(values)) for key, values in request.query_params.lists())
+    renderer = getattr(request, 'accepted_renderer', None)
+    raw = repr((data_version(), request.get_host(), request.path, params,
+                getattr(renderer, 'format', None)) + parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def record(metric):
+    cache = get_cache()
+    key = f'listings:metrics:{metric}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def cache_metrics():
+    cache = get_cache()
+    values = cache.get_many([f'listings:metrics:{metric}' for metric in METRICS])
+    metrics = {metric: values.get(f'listings:metrics:{metric}', 0) for metric in METRICS}
+    served = sum(metrics.values())
+    metrics['hit_rate'] = (
+        (metrics['hits'] + metrics['not_modified']) / served if served else None)
+    metrics['data_version'] = data_version()
+    return metrics
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+class CachedResponseMixin:
+    """
+    Caches the data of list and retrieve responses under a key built from
+    the normalised query string and the current data version. Clients that
+    send back the ETag get a 304 before anything is queried or serialized.
+    """
+
+    def cached_response(self, request, build):
+        key = cache_key(request, self.action, tuple(sorted(self.kwargs.items())))
+        etag = f'"{key}"'
+
+        if etag_matches(request, etag):
+            record('not_modified')
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        cache = get_cache()
+        data = cache.get(f'listings:response:{key}')
+        if data is not None:
+            record('hits')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+        else:
+            record('misses')
+            response = build()
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(f'listings:response:{key}', response.data, CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+
+        response['ETag'] = etag
+        return response
@@ -0,0 +1,127 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .models import ListingAmenity, ListingImage
+
+CHUNK_SIZE = getattr(settings, 'LISTINGS_EXPORT_CHUNK_SIZE', 2000)
+
+LISTING_COLUMNS = (
+    'id', 'title', 'location', 'address', 'price_per_night', 'currency',
+    'total_price', 'rating', 'description', 'reviews_count', 'property_type',
+    'created_at', 'updated_at',
+)
+HOST_COLUMNS = ('id', 'name', 'image_url', 'is_superhost', 'joined_date')
+CSV_COLUMNS = LISTING_COLUMNS + tuple(f'host_{column}' for column in HOST_COLUMNS) + (
+    'image_urls', 'amenities')
+# Separates image URLs and amenity names inside one CSV cell
+CSV_LIST_SEPARATOR = '|'
+
+
+def iter_chunks(queryset, chunk_size=CHUNK_SIZE, by_location=False):
+    """
+    Export records for `queryset`, yielded as lists of at most `chunk_size`.
+
+    Every chunk is its own keyset query on id, or on (location, id) when
+    `by_location` is set, followed by one query for the images and one for
+    the amenities of those listings. MySQL drivers buffer whole result sets,
+    so a single .iterator() would not keep memory flat.
+    """
+    columns = LISTING_COLUMNS + tuple(f'host__{column}' for column in HOST_COLUMNS)
+    ordering = ('location', 'pk') if by_location else ('pk',)
+    queryset = (queryset.select_related(None).prefetch_related(None)
+                .order_by(*ordering).values(*columns))
+
+    last = None
+    while True:
+        if last is None:
+            page = queryset
+        elif by_location:
+            page = queryset.filter(Q(location__gt=last['location'])
+                                   | Q(location=last['location'], pk__gt=last['id']))
+        else:
+            page = queryset.filter(pk__gt=last['id'])
+        rows = list(page[:chunk_size])
+        if not rows:
+            return
+        last = rows[-1]
+
+        listing_ids = [row['id'] for row in rows]
+        images = defaultdict(list)
+        for listing_id, image_id, image_url, is_primary in (
+                ListingImage.objects.filter(listing_id__in=listing_ids)
+                .order_by('listing_id', 'id')
+                .values_list('listing_id', 'id', 'image_url', 'is_primary')):
+            images[listing_id].append(
+                {'id': image_id, 'image_url': image_url, 'is_primary': is_primary})
+
+        amenities = defaultdict(list)
+        for listing_id, amenity_id, name in (
+                ListingAmenity.objects.filter(listing_id__in=listing_ids)
+                .order_by('listing_id', 'amenity_id')
+                .values_list('listing_id', 'amenity_id', 'amenity__name')):
+            amenities[listing_id].append({'id': amenity_id, 'name': name})
+
+        yield [record(row, images[row['id']], amenities[row['id']]) for row in rows]
+
+        if len(rows) < chunk_size:
+            return
+
+
+def record(row, images, amenities):
+    """One listing shaped like ListingSerializer output."""
+    item = {column: row[column] for column in LISTING_COLUMNS}
+    item['host'] = {column: row[f'host__{column}'] for column in HOST_COLUMNS}
+    item['images'] = images
+    item['amenities'] = amenities
+    return item
+
+
+def ndjson_stream(chunks):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for chunk in chunks:
+        yield ''.join(encoder.encode(item) + '\n' for item in chunk)
+
+
+def csv_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def csv_stream(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    # The header goes out before the first query runs
+    writer.writerow(CSV_COLUMNS)
+    yield flush()
+
+    for chunk in chunks:
+        for item in chunk:
+            host = item['host']
+            writer.writerow(
+                [csv_value(item[column]) for column in LISTING_COLUMNS]
+                + [csv_value(host[column]) for column in HOST_COLUMNS]
+                + [CSV_LIST_SEPARATOR.join(image['image_url'] for image in item['images']),
+                   CSV_LIST_SEPARATOR.join(amenity['name'] for amenity in item['amenities'])]
+            )
+        yield flush()
+
+
+# ?as= value -> (content type, file extension, stream function)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson', ndjson_stream),
+    'csv': ('text/csv', 'csv', csv_stream),
+}
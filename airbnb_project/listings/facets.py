@@ -0,0 +1,73 @@
+from collections import Counter
+
+from django.db.models import Case, CharField, Count, Value, When
+
+from .models import ListingAmenity
+
+# Lower bounds of the price buckets, per night
+PRICE_BUCKETS = (0, 50, 100, 150, 200, 300, 500)
+# (label, lowest rating) from the top band down
+RATING_BANDS = (('4.5+', 4.5), ('4.0-4.5', 4.0), ('3.5-4.0', 3.5), ('<3.5', 0))
+TOP_AMENITIES = 10
+
+
+def price_bucket():
+    whens = []
+    for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:]):
+        whens.append(When(price_per_night__lt=high, then=Value(f'{low}-{high}')))
+    return Case(*whens, default=Value(f'{PRICE_BUCKETS[-1]}+'), output_field=CharField())
+
+
+def rating_band():
+    whens = [When(rating__isnull=True, then=Value('unrated'))]
+    whens += [When(rating__gte=low, then=Value(label)) for label, low in RATING_BANDS]
+    return Case(*whens, output_field=CharField())
+
+
+def facet_counts(queryset, top_amenities=TOP_AMENITIES):
+    """
+    Counts per property type, currency, price bucket and rating band for
+    `queryset`, plus its most common amenities. The first four come from a
+    single GROUP BY over all four columns, summed per facet here; the
+    amenities take one more grouped query.
+    """
+    queryset = queryset.select_related(None).prefetch_related(None).order_by()
+    groups = (queryset
+              .annotate(price_bucket=price_bucket(), rating_band=rating_band())
+              .values('property_type', 'currency', 'price_bucket', 'rating_band')
+              .annotate(count=Count('id')))
+
+    facets = {name: Counter() for name in
+              ('property_type', 'currency', 'price_bucket', 'rating_band')}
+    total = 0
+    for group in groups:
+        for name, counts in facets.items():
+            counts[group[name]] += group['count']
+        total += group['count']
+
+    amenities = (ListingAmenity.objects
+                 .filter(listing__in=queryset.values('id'))
+                 .values('amenity__name')
+                 .annotate(count=Count('id'))
+                 .order_by('-count', 'amenity__name')[:top_amenities])
+
+    price_order = [f'{low}-{high}' for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:])]
+    price_order.append(f'{PRICE_BUCKETS[-1]}+')
+    band_order = [label for label, _ in RATING_BANDS] + ['unrated']
+    return {
+        'count': total,
+        'property_type': facet_list(facets['property_type'].most_common()),
+        'currency': facet_list(facets['currency'].most_common()),
+        'price_bucket': facet_list(
+            (label, facets['price_bucket'][label]) for label in price_order
+            if facets['price_bucket'][label]),
+        'rating_band': facet_list(
+            (label, facets['rating_band'][label]) for label in band_order
+            if facets['rating_band'][label]),
+        'amenities': facet_list(
+            (row['amenity__name'], row['count']) for row in amenities),
+    }
+
+
+def facet_list(pairs):
+    return [{'value': value, 'count': count} for value, count in pairs]
@@ -0,0 +1,294 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+
+from airbnb_scraper.db import amenity_bits, night_masks
+from listings.amenity_index import filter_amenities, get_amenity_index
+from listings.availability import filter_available
+from listings.models import (
+    Amenity, DataVersion, Host, Listing, ListingAmenity, ListingAvailability,
+)
+from listings.search import LikeSearchBackend, get_search_backend, ranked
+from listings.serializers import ListingSerializer, summarize, summary_queryset
+
+WORDS = (
+    'cozy', 'modern', 'loft', 'studio', 'apartment', 'villa', 'cabin', 'beach',
+    'downtown', 'quiet', 'sunny', 'garden', 'view', 'historic', 'spacious',
+    'family', 'charming', 'rooftop', 'lake', 'mountain', 'central', 'bright',
+)
+# Filler for descriptions: made-up three-syllable words, so that like real
+# text most words are rare and a search term matches a small share of rows
+SYLLABLES = tuple(c + v for c in 'bdfgklmnprstvz' for v in 'aeiou')
+AMENITIES = (
+    'Wifi', 'Kitchen', 'Washer', 'Dryer', 'Air conditioning', 'Heating',
+    'Dedicated workspace', 'TV', 'Hair dryer', 'Iron', 'Pool', 'Hot tub',
+    'Free parking', 'EV charger', 'Crib', 'Gym', 'BBQ grill', 'Breakfast',
+    'Indoor fireplace', 'Smoking allowed', 'Beachfront', 'Waterfront',
+    'Ski-in/ski-out', 'Smoke alarm', 'Carbon monoxide alarm', 'Pets allowed',
+)
+LOCATIONS = (
+    'New York', 'Los Angeles', 'Chicago', 'Miami', 'Austin', 'Seattle',
+    'Boston', 'Denver', 'San Francisco', 'New Orleans', 'Portland', 'Nashville',
+)
+
+
+def filler_words(count, seed=1):
+    rng = random.Random(seed)
+    found = set()
+    while len(found) < count:
+        found.add(''.join(rng.choices(SYLLABLES, k=3)))
+    return sorted(found)
+
+
+FILLER = filler_words(3000)
+
+
+def timed(fn, repeat):
+    """Median wall time of `fn` over `repeat` runs, in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+class Command(BaseCommand):
+    help = ('Micro-benchmarks for listing queries against the configured '
+            'database. --seed adds synthetic listings first, plus calendars '
+            'or amenities for the suites that need them when there are none; '
+            'only use it on a scratch database.')
+    suites = ('search', 'serializers', 'availability', 'amenities')
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=self.suites)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Insert this many synthetic listings before running')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Runs per measurement (the median is reported)')
+
+    def handle(self, *args, **options):
+        # Suites that need calendars or amenities only make them up with --seed
+        self.seeding = bool(options['seed'])
+        if options['seed']:
+            self.seed(options['seed'])
+        if not Listing.objects.exists():
+            raise CommandError('No listings to benchmark; pass --seed N')
+        getattr(self, f"bench_{options['suite']}")(options['repeat'])
+
+    def seed(self, count, batch_size=5000):
+        rng = random.Random(0)
+        with transaction.atomic():
+            hosts = Host.objects.bulk_create(
+                [Host(name=f'Bench host {i}') for i in range(max(count // 50, 1))])
+            for start in range(0, count, batch_size):
+                Listing.objects.bulk_create([
+                    Listing(
+                        title=' '.join(rng.sample(WORDS, 3)).title(),
+                        location=rng.choice(LOCATIONS),
+                        description=' '.join(
+                            rng.sample(WORDS, 4) + rng.choices(FILLER, k=36)),
+                        price_per_night=rng.randint(30, 900),
+                        rating=round(rng.uniform(3, 5), 2),
+                        reviews_count=rng.randint(0, 500),
+                        property_type=rng.choice(('Apartment', 'House', 'Loft', 'Cabin')),
+                        host=rng.choice(hosts),
+                    )
+                    for _ in range(start, min(start + batch_size, count))
+                ])
+        self.stdout.write(f'Seeded {count} listings')
+
+    def report(self, label, baseline, candidate, rows=None):
+        speedup = baseline / candidate if candidate else float('inf')
+        line = f'{label:<32} {baseline:9.2f}ms {candidate:9.2f}ms {speedup:7.1f}x'
+        if rows:
+            line += (f'  {rows / baseline * 1000:10.0f} vs '
+                     f'{rows / candidate * 1000:10.0f} rows/s')
+        self.stdout.write(line)
+
+    def bench_search(self, repeat):
+        like = LikeSearchBackend()
+        backend = get_search_backend()
+        total = Listing.objects.count()
+        self.stdout.write(
+            f'{total} listings, LIKE vs {type(backend).__name__} '
+            f'(count and first page of 20, as the API serves a search)')
+
+        queryset = Listing.objects.order_by('-created_at')
+
+        def page(results):
+            # Best match first where the backend ranks, as ListingSearchFilter does
+            if ranked(results):
+                results = results.order_by('-search_rank', '-id')
+            return results.count(), list(results[:20])
+
+        # Common words first, then filler words only a few listings contain
+        # and one none do, where LIKE has to read every row
+        for terms in (['cozy'], ['beach', 'view'], ['historic loft'],
+                      [FILLER[1000]], [FILLER[2000], 'quiet'], ['nowhere']):
+            matches = like.search(queryset, terms).count()
+            self.report(
+                f'search={" ".join(terms)} ({matches})',
+                timed(lambda: page(like.search(queryset, terms)), repeat),
+                timed(lambda: page(backend.search(queryset, terms)), repeat))
+
+        for location in ('New York', 'Miami'):
+            self.report(
+                f'location={location}',
+                timed(lambda: page(like.filter_location(queryset, location)), repeat),
+                timed(lambda: page(backend.filter_location(queryset, location)), repeat))
+
+    def bench_serializers(self, repeat):
+        total = Listing.objects.count()
+        self.stdout.write(
+            f'{total} listings, ListingSerializer vs ?view=summary (query + serialize)')
+
+        queryset = Listing.objects.order_by('-created_at')
+        full = queryset.select_related('host').prefetch_related(
+            'images',
+            Prefetch('listing_amenities',
+                     queryset=ListingAmenity.objects.select_related('amenity')),
+        )
+        for size in (20, 100, 1000):
+            rows = min(size, total)
+            self.report(
+                f'page of {size}',
+                timed(lambda: ListingSerializer(full[:size], many=True).data, repeat),
+                timed(lambda: summarize(summary_queryset(queryset)[:size]), repeat),
+                rows=rows)
+
+    def seed_availability(self, months=12, batch_size=5000):
+        """A year of calendars, each night free with probability 0.7."""
+        rng = random.Random(0)
+        first = date.today().replace(day=1)
+        month_starts = []
+        for _ in range(months):
+            month_starts.append(first)
+            first = (first + timedelta(days=32)).replace(day=1)
+
+        listing_ids = list(Listing.objects.values_list('id', flat=True))
+        with transaction.atomic():
+            rows = (
+                ListingAvailability(
+                    listing_id=listing_id, month=month,
+                    days=sum(1 << day for day in range(31) if rng.random() < 0.7))
+                for listing_id in listing_ids for month in month_starts)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    ListingAvailability.objects.bulk_create(batch)
+                    batch = []
+            ListingAvailability.objects.bulk_create(batch)
+        Listing.objects.filter(max_guests__isnull=True).update(max_guests=4)
+        self.stdout.write(f'Seeded {len(listing_ids) * months} availability rows')
+
+    def bench_availability(self, repeat):
+        if not ListingAvailability.objects.exists():
+            if not self.seeding:
+                raise CommandError('No availability rows to benchmark; pass --seed N '
+                                   'on a scratch database to make some up')
+            self.seed_availability()
+        total = ListingAvailability.objects.count()
+        self.stdout.write(
+            f'{total} availability rows, scan in Python vs bitmap query (all matches)')
+
+        def scan(check_in, check_out):
+            # Read every calendar row of the months involved and test it here
+            masks = night_masks(check_in, check_out)
+            free = {}
+            for listing_id, month, days in ListingAvailability.objects.filter(
+                    month__in=list(masks)).values_list('listing_id', 'month', 'days'):
+                if days & masks[month] == masks[month]:
+                    free[listing_id] = free.get(listing_id, 0) + 1
+            matched = [listing_id for listing_id, months in free.items()
+                       if months == len(masks)]
+            return list(Listing.objects.filter(id__in=matched, max_guests__gte=2)
+                        .values_list('id', flat=True))
+
+        def query(check_in, check_out):
+            return list(filter_available(Listing.objects.filter(max_guests__gte=2),
+                                         check_in, check_out).values_list('id', flat=True))
+
+        start = date.today() + timedelta(days=20)
+        month_end = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        for label, check_in, nights in (
+                ('2 nights', start, 2),
+                ('7 nights', start, 7),
+                ('7 nights across months', month_end - timedelta(days=3), 7),
+                ('30 nights', start, 30)):
+            check_out = check_in + timedelta(days=nights)
+            matches = len(query(check_in, check_out))
+            self.report(
+                f'{label} ({matches} free)',
+                timed(lambda: scan(check_in, check_out), repeat),
+                timed(lambda: query(check_in, check_out), repeat))
+
+    def seed_amenities(self, batch_size=2000):
+        """3 to 15 amenities per listing, common ones more likely."""
+        rng = random.Random(0)
+        amenities = [Amenity.objects.get_or_create(name=name)[0] for name in AMENITIES]
+        weights = [len(amenities) - i for i in range(len(amenities))]
+
+        listing_ids = list(Listing.objects.values_list('id', flat=True))
+        with transaction.atomic():
+            for start in range(0, len(listing_ids), batch_size):
+                links = []
+                listings = []
+                for listing_id in listing_ids[start:start + batch_size]:
+                    chosen = {amenity.id for amenity in
+                              rng.choices(amenities, weights, k=rng.randint(3, 15))}
+                    links.extend(ListingAmenity(listing_id=listing_id, amenity_id=amenity_id)
+                                 for amenity_id in chosen)
+                    listings.append(Listing(id=listing_id, amenity_bits=amenity_bits(chosen)))
+                ListingAmenity.objects.bulk_create(links, ignore_conflicts=True)
+                Listing.objects.bulk_update(listings, ['amenity_bits'])
+        DataVersion.bump()
+        self.stdout.write(f'Seeded amenities for {len(listing_ids)} listings')
+
+    def bench_amenities(self, repeat):
+        if not ListingAmenity.objects.exists():
+            if not self.seeding:
+                raise CommandError('No listing amenities to benchmark; pass --seed N '
+                                   'on a scratch database to make some up')
+            self.seed_amenities()
+
+        started = time.perf_counter()
+        get_amenity_index()
+        self.stdout.write(
+            f'{Listing.objects.count()} listings, one join per amenity vs bitmap index '
+            f'(index built in {(time.perf_counter() - started) * 1000:.0f}ms)')
+
+        amenity_ids = dict(Amenity.objects.values_list('name', 'id'))
+        queryset = Listing.objects.order_by('-created_at')
+
+        def joins(names, match_all):
+            if match_all:
+                result = queryset
+                for name in names:
+                    result = result.filter(listing_amenities__amenity_id=amenity_ids[name])
+            else:
+                result = queryset.filter(
+                    listing_amenities__amenity_id__in=[amenity_ids[name] for name in names]
+                ).distinct()
+            return list(result.values_list('id', flat=True)[:20])
+
+        def bitmap(names, match_all):
+            return list(filter_amenities(queryset, names, match_all)
+                        .values_list('id', flat=True)[:20])
+
+        for names, match_all in (
+                (['Wifi', 'Kitchen'], True),
+                (['Wifi', 'Kitchen', 'Washer'], True),
+                (['Pool', 'Hot tub', 'Gym', 'EV charger'], True),
+                (['Pool', 'Hot tub', 'Beachfront'], False)):
+            label = (' AND ' if match_all else ' OR ').join(names)
+            self.report(
+                label[:32],
+                timed(lambda: joins(names, match_all), repeat),
+                timed(lambda: bitmap(names, match_all), repeat))
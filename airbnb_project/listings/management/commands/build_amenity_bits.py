@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from airbnb_scraper.db import amenity_bits
+from listings.models import DataVersion, Listing, ListingAmenity
+
+
+class Command(BaseCommand):
+    help = ('Fill Listing.amenity_bits from listing_amenities for listings '
+            'stored before the scraper maintained it (every listing with '
+            '--all). Safe to run repeatedly.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute the bitset of every listing')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        queryset = Listing.objects.order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(amenity_bits__isnull=True)
+
+        total = 0
+        last_id = 0
+        while True:
+            listing_ids = list(queryset.filter(pk__gt=last_id)
+                               .values_list('id', flat=True)[:options['batch_size']])
+            if not listing_ids:
+                break
+
+            amenities = defaultdict(list)
+            for listing_id, amenity_id in ListingAmenity.objects.filter(
+                    listing_id__in=listing_ids).values_list('listing_id', 'amenity_id'):
+                amenities[listing_id].append(amenity_id)
+
+            # updated_at moves too, so running API processes pick the rows
+            # up when they refresh their amenity index
+            now = timezone.now()
+            Listing.objects.bulk_update(
+                [Listing(id=listing_id, amenity_bits=amenity_bits(amenities[listing_id]),
+                         updated_at=now)
+                 for listing_id in listing_ids],
+                ['amenity_bits', 'updated_at'])
+
+            total += len(listing_ids)
+            last_id = listing_ids[-1]
+
+        if total:
+            DataVersion.bump()
+        self.stdout.write(self.style.SUCCESS(f'Updated amenity bits of {total} listings'))
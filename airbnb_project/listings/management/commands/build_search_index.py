@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from listings.search import configured_search_backend
+
+
+class Command(BaseCommand):
+    help = ('Create the full-text index used for listing search (MySQL '
+            'FULLTEXT or SQLite FTS5) if it is missing. Safe to run repeatedly.')
+
+    def handle(self, *args, **options):
+        backend = configured_search_backend()
+        backend.ensure_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Search index ready ({type(backend).__name__})'))
@@ -0,0 +1,109 @@
+import itertools
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+
+from listings.models import Listing
+from listings.views import ListingViewSet
+
+# listings_listing itself; not the listings_listing_fts virtual table
+SQLITE_TABLE_SCAN = re.compile(r'^SCAN (TABLE )?listings_listing\b(?! USING)')
+
+
+def listing_queryset(params):
+    """The queryset ListingViewSet.list would page through for `params`."""
+    request = Request(APIRequestFactory().get('/api/listings/', params))
+    view = ListingViewSet(request=request, action='list',
+                          format_kwarg=None, args=(), kwargs={})
+    return view.get_list_queryset()
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN the queries ListingViewSet runs for each filter and '
+            'ordering it serves and fail if any of them scans the whole '
+            'listings table. Run it against a realistically sized database; '
+            'MySQL will happily scan a near-empty table.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location',
+                            help='Location to filter on (defaults to the most common one)')
+        parser.add_argument('--property-type',
+                            help='Property type to filter on (defaults to the most common one)')
+        parser.add_argument('--allow-scans', action='store_true',
+                            help='Report full scans without failing')
+
+    def handle(self, *args, **options):
+        location = options['location'] or self.most_common('location') or 'New York'
+        property_type = options['property_type'] or \
+            self.most_common('property_type') or 'Apartment'
+
+        filters = [
+            {},
+            {'location': location},
+            {'property_type': property_type},
+            {'location': location, 'property_type': property_type},
+        ]
+        orderings = [None] + [
+            prefix + field
+            for field in ListingViewSet.ordering_fields
+            for prefix in ('', '-')
+        ]
+
+        page_size = api_settings.PAGE_SIZE or 20
+        scans = []
+        for params, ordering in itertools.product(filters, orderings):
+            params = dict(params)
+            if ordering:
+                params['ordering'] = ordering
+
+            queryset = listing_queryset(params)[:page_size]
+            sql, sql_params = queryset.query.sql_with_params()
+            plan, full_scan = self.explain(sql, sql_params)
+
+            started = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute(sql, sql_params)
+                cursor.fetchall()
+            elapsed = (time.perf_counter() - started) * 1000
+
+            label = '&'.join(f'{key}={value}' for key, value in params.items()) or '(none)'
+            status = self.style.ERROR('FULL SCAN') if full_scan else self.style.SUCCESS('ok')
+            self.stdout.write(f'{status:<20} {elapsed:8.2f}ms  {label}')
+            if full_scan or options['verbosity'] > 1:
+                self.stdout.write(f'    {plan}')
+            if full_scan:
+                scans.append(label)
+
+        if scans and not options['allow_scans']:
+            raise CommandError(
+                f'{len(scans)} listing queries scan the whole table: {", ".join(scans)}')
+
+    def most_common(self, field):
+        row = (Listing.objects.exclude(**{f'{field}__isnull': True})
+               .values(field).annotate(n=Count('id')).order_by('-n').first())
+        return row[field] if row else None
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute('EXPLAIN ' + sql, params)
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                full_scan = any(row['table'] == 'listings_listing' and row['type'] == 'ALL'
+                                for row in rows)
+                plan = '; '.join(f"{row['table']}: type={row['type']} key={row['key']}"
+                                 for row in rows)
+            elif connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                details = [row[3] for row in cursor.fetchall()]
+                full_scan = any(SQLITE_TABLE_SCAN.match(detail) for detail in details)
+                plan = '; '.join(details)
+            else:
+                raise CommandError(f'Unsupported database vendor: {connection.vendor}')
+        return plan, full_scan
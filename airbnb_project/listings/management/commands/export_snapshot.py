@@ -0,0 +1,189 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone as django_timezone
+from django.utils.dateparse import parse_datetime
+
+from listings.export import iter_chunks
+from listings.models import Listing
+
+WATERMARK_FILE = 'listings.watermark.json'
+# The scraper stamps updated_at when a batch starts and commits it later,
+# with several batches in flight, so rows can appear with an updated_at
+# older than ones already visible. Snapshots stop this far behind now, so
+# every batch stamped before the watermark has committed by then.
+SETTLE_MINUTES = 10
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def snapshot_schema(pa):
+    # Low-cardinality text is dictionary encoded; amenities are one list
+    # column per listing rather than a separate join table, and Parquet
+    # dictionary encodes their names on disk
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('id', pa.int64()),
+        ('title', pa.string()),
+        ('location', category),
+        ('address', pa.string()),
+        ('price_per_night', pa.decimal128(10, 2)),
+        ('currency', category),
+        ('total_price', pa.decimal128(10, 2)),
+        ('rating', pa.decimal128(3, 2)),
+        ('description', pa.string()),
+        ('reviews_count', pa.int32()),
+        ('property_type', category),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+        ('updated_at', pa.timestamp('us', tz='UTC')),
+        ('host_id', pa.int64()),
+        ('host_name', pa.string()),
+        ('host_is_superhost', pa.bool_()),
+        ('host_joined_date', pa.date32()),
+        ('image_urls', pa.list_(pa.string())),
+        ('amenities', pa.list_(pa.string())),
+    ])
+
+
+def snapshot_columns(chunk):
+    """export.iter_chunks records as a dict of columns."""
+    return {
+        'id': [item['id'] for item in chunk],
+        'title': [item['title'] for item in chunk],
+        'location': [item['location'] for item in chunk],
+        'address': [item['address'] for item in chunk],
+        'price_per_night': [item['price_per_night'] for item in chunk],
+        'currency': [item['currency'] for item in chunk],
+        'total_price': [item['total_price'] for item in chunk],
+        'rating': [item['rating'] for item in chunk],
+        'description': [item['description'] for item in chunk],
+        'reviews_count': [item['reviews_count'] for item in chunk],
+        'property_type': [item['property_type'] for item in chunk],
+        'created_at': [item['created_at'] for item in chunk],
+        'updated_at': [item['updated_at'] for item in chunk],
+        'host_id': [item['host']['id'] for item in chunk],
+        'host_name': [item['host']['name'] for item in chunk],
+        'host_is_superhost': [item['host']['is_superhost'] for item in chunk],
+        'host_joined_date': [item['host']['joined_date'] for item in chunk],
+        'image_urls': [[image['image_url'] for image in item['images']] for item in chunk],
+        'amenities': [[amenity['name'] for amenity in item['amenities']] for item in chunk],
+    }
+
+
+class Command(BaseCommand):
+    help = ('Write listings changed since the last snapshot, with their host '
+            'and amenities, to a Parquet or Arrow IPC file. Each run adds one '
+            'file; for a given id the newest file holds the current row. '
+            'Listings are read in one pass ordered by location and a new '
+            'row group starts whenever the location changes, so reading one '
+            'city only touches its row groups. Requires pyarrow.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default='snapshots',
+                            help='Directory for snapshot files and the watermark')
+        parser.add_argument('--format', dest='file_format', choices=sorted(EXTENSIONS),
+                            default='parquet',
+                            help='parquet, or arrow for memory-mappable IPC files')
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the watermark and export every listing')
+        parser.add_argument('--settle-minutes', type=float, default=SETTLE_MINUTES,
+                            help='Leave rows updated this recently for the next '
+                                 'snapshot; must exceed the longest scraper batch')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Listings read per query and most written per record batch')
+
+    def handle(self, *args, **options):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise CommandError('export_snapshot requires pyarrow (pip install pyarrow)')
+
+        output_dir = options['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+        watermark_path = os.path.join(output_dir, WATERMARK_FILE)
+        since = None if options['full'] else self.read_watermark(watermark_path)
+
+        # Rows updated less than the settle time ago, or while the snapshot
+        # runs, are left for the next one
+        until = Listing.objects.aggregate(latest=Max('updated_at'))['latest']
+        settled = django_timezone.now() - timedelta(minutes=options['settle_minutes'])
+        if until is not None:
+            until = min(until, settled)
+        if until is None or (since is not None and until <= since):
+            self.stdout.write('No listings changed since the last snapshot')
+            return
+
+        queryset = Listing.objects.filter(updated_at__lte=until)
+        if since is not None:
+            queryset = queryset.filter(updated_at__gt=since)
+
+        schema = snapshot_schema(pa)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        extension = EXTENSIONS[options['file_format']]
+        path = os.path.join(output_dir, f'listings-{stamp}.{extension}')
+        part_path = path + '.part'
+
+        writer = self.open_writer(pa, options['file_format'], part_path, schema)
+        rows = 0
+        pending = []
+
+        def flush():
+            nonlocal rows
+            if pending:
+                batch = pa.RecordBatch.from_pydict(snapshot_columns(pending), schema=schema)
+                self.write_batch(pa, writer, batch)
+                rows += len(pending)
+                pending.clear()
+
+        try:
+            # One pass over (location, id); a batch never spans two
+            # locations, and small locations fill one batch instead of
+            # leaving a row group per chunk boundary
+            for chunk in iter_chunks(queryset, options['chunk_size'], by_location=True):
+                for item in chunk:
+                    if pending and (item['location'] != pending[-1]['location']
+                                    or len(pending) >= options['chunk_size']):
+                        flush()
+                    pending.append(item)
+            flush()
+        except BaseException:
+            writer.close()
+            os.remove(part_path)
+            raise
+        writer.close()
+        os.replace(part_path, path)
+
+        with open(watermark_path, 'w') as f:
+            json.dump({'updated_at': until.isoformat(), 'rows': rows,
+                       'file': os.path.basename(path)}, f)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {rows} listings to {path} (watermark {until.isoformat()})'))
+
+    def read_watermark(self, path):
+        try:
+            with open(path) as f:
+                value = json.load(f)['updated_at']
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            raise CommandError(f'Unreadable watermark {path}: {e}; pass --full to start over')
+
+        watermark = parse_datetime(value)
+        if watermark is None:
+            raise CommandError(f'Unreadable watermark {path}: {value!r}; pass --full to start over')
+        return watermark
+
+    def open_writer(self, pa, file_format, path, schema):
+        if file_format == 'arrow':
+            return pa.ipc.new_file(path, schema)
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(path, schema, compression='zstd')
+
+    def write_batch(self, pa, writer, batch):
+        if isinstance(writer, pa.ipc.RecordBatchFileWriter):
+            writer.write_batch(batch)
+        else:
+            writer.write_table(pa.Table.from_batches([batch]))
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from listings.rollups import rebuild_location_stats
+
+
+class Command(BaseCommand):
+    help = ('Recompute the per-location rollups behind /api/locations/stats/ '
+            'from scratch. The scraper keeps them current; run this after '
+            'loading data by other means or to correct drift, e.g. from hosts '
+            'changing superhost status.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_location_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt stats for {count} locations in {time.perf_counter() - started:.1f}s'))
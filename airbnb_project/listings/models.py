@@ -1,8 +1,12 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Host(models.Model):
-    name = models.CharField(max_length=255)
+    # Airbnb user id, when the host profile link exposes one
+    airbnb_id = models.CharField(
+        max_length=32, unique=True, blank=True, null=True)
+    name = models.CharField(max_length=255, db_index=True)
     image_url = models.URLField(max_length=1000, blank=True, null=True)
     is_superhost = models.BooleanField(default=False)
     joined_date = models.DateField(blank=True, null=True)
@@ -12,6 +16,9 @@ class Host(models.Model):
 
 
 class Listing(models.Model):
+    # Numeric room id from the /rooms/<id> URL
+    airbnb_id = models.CharField(
+        max_length=32, unique=True, blank=True, null=True)
     title = models.CharField(max_length=255)
     location = models.CharField(max_length=255)
     address = models.CharField(max_length=255, blank=True, null=True)
@@ -24,14 +31,176 @@ class Listing(models.Model):
     description = models.TextField(blank=True, null=True)
     reviews_count = models.IntegerField(default=0)
     property_type = models.CharField(max_length=100, blank=True, null=True)
+    # Largest party the listing has turned up in a search for
+    max_guests = models.PositiveSmallIntegerField(blank=True, null=True)
     host = models.ForeignKey(
         Host, on_delete=models.CASCADE, related_name='listings')
+    # SHA-256 of the scraped fields, used by the scraper to skip rewrites of
+    # listings that have not changed since the last crawl
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
+    # Amenity ids as a little-endian bitset (bit n = Amenity n), kept in
+    # step with listing_amenities by the scraper for amenity filtering
+    amenity_bits = models.BinaryField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    last_seen_at = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
         return self.title
 
+    class Meta:
+        indexes = [
+            # Default ordering and keyset pagination position
+            models.Index(fields=['created_at', 'id'],
+                         name='listing_created_id_idx'),
+            # Orderings offered by ListingViewSet without a filter
+            models.Index(fields=['price_per_night'], name='listing_price_idx'),
+            models.Index(fields=['rating'], name='listing_rating_idx'),
+            models.Index(fields=['reviews_count'], name='listing_reviews_idx'),
+            # ?property_type=; ?location= goes through the search index
+            models.Index(fields=['property_type', 'created_at'],
+                         name='listing_type_created_idx'),
+            # Listings changed since a point in time: amenity index refreshes
+            # and incremental snapshots
+            models.Index(fields=['updated_at'], name='listing_updated_idx'),
+            # export_snapshot walks listings grouped by location
+            models.Index(fields=['location', 'id'], name='listing_location_id_idx'),
+        ]
+
+
+class DataVersion(models.Model):
+    """
+    Single-row counter the scraper bumps whenever it commits listing changes;
+    API response caches are keyed on it.
+    """
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Data version {self.version}"
+
+    @classmethod
+    def bump(cls):
+        """Invalidate caches after changing listings outside the scraper."""
+        updated = cls.objects.filter(pk=1).update(
+            version=models.F('version') + 1, updated_at=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+class ListingAvailability(models.Model):
+    """
+    Nights a listing was found available in one calendar month, as a bitmap:
+    bit 0 is the 1st of the month, bit 30 the 31st.
+    """
+    listing = models.ForeignKey(
+        Listing, on_delete=models.CASCADE, related_name='availability')
+    # Always the first day of the month
+    month = models.DateField()
+    days = models.IntegerField(default=0)
+    # Start of the latest crawl that wrote the row, and the nights it found
+    # free; once that crawl finishes, nights it searched but did not find
+    # are dropped (listings.availability.settle_searched_nights)
+    observed_at = models.DateTimeField(blank=True, null=True)
+    observed_days = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Availability for {self.listing.title} in {self.month:%Y-%m}"
+
+    class Meta:
+        unique_together = ('listing', 'month')
+        verbose_name_plural = "Listing Availability"
+        indexes = [
+            # Covers the per-month availability filter without table reads
+            models.Index(fields=['month', 'days', 'listing'],
+                         name='availability_month_idx'),
+        ]
+
+
+class PriceObservation(models.Model):
+    """
+    Price and rating of a listing as scraped on a day. The scraper only adds
+    one when they differ from the listing's latest observation, so each row
+    holds until the next one.
+    """
+    listing = models.ForeignKey(
+        Listing, on_delete=models.CASCADE, related_name='price_observations')
+    observed_on = models.DateField()
+    price_per_night = models.DecimalField(max_digits=10, decimal_places=2)
+    total_price = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True)
+    rating = models.DecimalField(
+        max_digits=3, decimal_places=2, blank=True, null=True)
+    currency = models.CharField(max_length=10, default='USD')
+
+    def __str__(self):
+        return f"{self.listing.title} on {self.observed_on}"
+
+    class Meta:
+        # Also the index for date range reads of one listing's history
+        unique_together = ('listing', 'observed_on')
+        indexes = [
+            models.Index(fields=['observed_on'], name='price_obs_date_idx'),
+        ]
+
+
+class LocationStats(models.Model):
+    """
+    Running per-location totals kept up to date by the scraper as it writes
+    listings, so the averages are one row read. Percentiles come from the
+    location's LocationPriceBucket histogram.
+    """
+    location = models.CharField(max_length=255, unique=True)
+    listing_count = models.IntegerField(default=0)
+    price_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    rated_count = models.IntegerField(default=0)
+    rating_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    superhost_count = models.IntegerField(default=0)
+    median_price = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True)
+    p90_price = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.location}"
+
+    class Meta:
+        verbose_name_plural = "Location Stats"
+
+    @property
+    def avg_price(self):
+        if not self.listing_count:
+            return None
+        return round(self.price_total / self.listing_count, 2)
+
+    @property
+    def avg_rating(self):
+        if not self.rated_count:
+            return None
+        return round(self.rating_total / self.rated_count, 2)
+
+    @property
+    def superhost_share(self):
+        if not self.listing_count:
+            return None
+        return round(self.superhost_count / self.listing_count, 4)
+
+
+class LocationPriceBucket(models.Model):
+    """Listings per price range in a location, for its percentiles."""
+    location = models.CharField(max_length=255)
+    # Lower bound; $5 wide below $1,000, $50 below $5,000, $500 above
+    bucket = models.IntegerField()
+    listing_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.location} from {self.bucket}"
+
+    class Meta:
+        unique_together = ('location', 'bucket')
+
 
 class ListingImage(models.Model):
     listing = models.ForeignKey(
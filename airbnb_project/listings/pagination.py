@@ -0,0 +1,159 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class ListingKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (ordering field, id). Every page is a single
+    range scan starting right after the previous page's last row, so deep
+    pages cost the same as the first one and no COUNT(*) is run unless a
+    client asks for `?count=approx`.
+    """
+    cursor_query_param = 'cursor'
+    ordering_param = api_settings.ORDERING_PARAM
+    count_query_param = 'count'
+    default_ordering = '-created_at'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = api_settings.PAGE_SIZE or 20
+        self.next_position = None
+        self.count = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request, view)
+        field_name = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+        field = queryset.model._meta.get_field(field_name)
+
+        if request.query_params.get(self.count_query_param) == 'approx':
+            self.count = self.approximate_count(queryset)
+
+        position = self.decode_cursor(request, field)
+        if position is not None:
+            value, pk = position
+            queryset = queryset.filter(
+                self.after(field, descending, value, pk))
+
+        # NULLs sort last so the cursor can walk into them. Only nullable
+        # fields ask for it: MySQL spells it `col IS NULL, col`, which no
+        # index can serve
+        nulls = {'nulls_last': True} if field.null else {}
+        order = F(field_name).desc(**nulls) if descending else F(field_name).asc(**nulls)
+        queryset = queryset.order_by(order, '-pk' if descending else 'pk')
+
+        results = list(queryset[:self.page_size + 1])
+        if len(results) > self.page_size:
+            results = results[:self.page_size]
+            last = results[-1]
+            if isinstance(last, dict):
+                # .values() rows, such as the summary view
+                last = queryset.model(pk=last['id'], **{field.attname: last[field.attname]})
+            self.next_position = (
+                field.value_to_string(last) if getattr(last, field.attname) is not None else None,
+                last.pk,
+            )
+        return results
+
+    def get_ordering(self, request, view):
+        # Follow the viewset's ?ordering= when it names one of its fields;
+        # only the first field is used, ties are broken by id
+        ordering = request.query_params.get(self.ordering_param, '')
+        ordering = ordering.split(',')[0].strip()
+        allowed = set(getattr(view, 'ordering_fields', None) or ()) | {'created_at'}
+        if ordering.lstrip('-') in allowed:
+            return ordering
+        return self.default_ordering
+
+    def after(self, field, descending, value, pk):
+        lookup = 'lt' if descending else 'gt'
+        if value is None:
+            # Already inside the trailing NULLs
+            return Q(**{f'{field.name}__isnull': True, f'pk__{lookup}': pk})
+
+        condition = Q(**{f'{field.name}__{lookup}': value}) | \
+            Q(**{field.name: value, f'pk__{lookup}': pk})
+        if field.null:
+            condition |= Q(**{f'{field.name}__isnull': True})
+        return condition
+
+    def approximate_count(self, queryset):
+        # Unfiltered collections use the table statistics, which MySQL keeps
+        # without scanning; anything else falls back to an exact count
+        connection = connections[queryset.db]
+        if connection.vendor == 'mysql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] is not None:
+                return row[0]
+        return queryset.count()
+
+    def decode_cursor(self, request, field):
+        """(ordering field value, id) of the cursor in `request`, or None."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            ordering, value, pk = payload['o'], payload['v'], int(payload['p'])
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        if ordering != self.ordering:
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            return None, pk
+
+        # Cursors come from clients, so the value may not fit the field
+        try:
+            return field.to_python(value), pk
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        value, pk = position
+        payload = json.dumps({'o': self.ordering, 'v': value, 'p': pk})
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict()
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,47 @@
+from .models import PriceObservation
+
+HISTORY_FIELDS = ('observed_on', 'price_per_night', 'total_price', 'rating', 'currency')
+DEFAULT_POINTS = 100
+MAX_POINTS = 1000
+
+
+def observation_history(listing, start=None, end=None, points=DEFAULT_POINTS):
+    """
+    Observations of `listing` between `start` and `end`, at most `points`
+    of them. The observation in force on `start` is included so the series
+    starts with the price that applied then. Longer series are split into
+    `points` equal date ranges, each keeping its last observation.
+    """
+    observations = PriceObservation.objects.filter(listing=listing).order_by('observed_on')
+    history = []
+    if start is not None:
+        before = (observations.filter(observed_on__lt=start)
+                  .order_by('-observed_on').values(*HISTORY_FIELDS).first())
+        if before is not None:
+            history.append(before)
+        observations = observations.filter(observed_on__gte=start)
+    if end is not None:
+        observations = observations.filter(observed_on__lte=end)
+    history.extend(observations.values(*HISTORY_FIELDS))
+
+    if len(history) > points:
+        history = downsample(history, points)
+    # Decimals as strings, the same as ListingSerializer
+    for observation in history:
+        for field in ('price_per_night', 'total_price', 'rating'):
+            if observation[field] is not None:
+                observation[field] = str(observation[field])
+    return history
+
+
+def downsample(history, points):
+    first = history[0]['observed_on']
+    span = (history[-1]['observed_on'] - first).days + 1
+    width = max(span / points, 1)
+
+    kept = {}
+    for observation in history:
+        slot = int((observation['observed_on'] - first).days / width)
+        # The last observation of a slot is the price its range ended on
+        kept[slot] = observation
+    return [kept[slot] for slot in sorted(kept)]
@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, When
+from django.db.models.functions import Floor
+
+from airbnb_scraper.db import BUCKET_STEPS, bucket_percentile
+
+from .models import Listing, LocationPriceBucket, LocationStats
+
+
+def price_bucket():
+    whens = [When(price_per_night__lt=limit,
+                  then=Floor(F('price_per_night') / step) * step)
+             for limit, step in BUCKET_STEPS if limit is not None]
+    step = BUCKET_STEPS[-1][1]
+    return Case(*whens, default=Floor(F('price_per_night') / step) * step,
+                output_field=IntegerField())
+
+
+@transaction.atomic
+def rebuild_location_stats():
+    """
+    Recompute every rollup from listings_listing with two grouped queries.
+    Returns the number of locations written.
+    """
+    totals = (Listing.objects.order_by().values('location').annotate(
+        listing_count=Count('id'),
+        price_total=Sum('price_per_night'),
+        rated_count=Count('rating'),
+        rating_total=Sum('rating'),
+        superhost_count=Count('id', filter=Q(host__is_superhost=True)),
+    ))
+    histogram = (Listing.objects.order_by().annotate(bucket=price_bucket())
+                 .values('location', 'bucket').annotate(listing_count=Count('id'))
+                 .order_by('location', 'bucket'))
+
+    buckets = {}
+    for row in histogram:
+        buckets.setdefault(row['location'], []).append((int(row['bucket']), row['listing_count']))
+
+    stats = []
+    for row in totals:
+        location_buckets = buckets.get(row['location'], [])
+        stats.append(LocationStats(
+            location=row['location'],
+            listing_count=row['listing_count'],
+            price_total=row['price_total'] or 0,
+            rated_count=row['rated_count'],
+            rating_total=row['rating_total'] or 0,
+            superhost_count=row['superhost_count'],
+            median_price=bucket_percentile(location_buckets, 0.5),
+            p90_price=bucket_percentile(location_buckets, 0.9),
+        ))
+
+    LocationPriceBucket.objects.all().delete()
+    LocationStats.objects.all().delete()
+    LocationStats.objects.bulk_create(stats, batch_size=1000)
+    LocationPriceBucket.objects.bulk_create(
+        [LocationPriceBucket(location=location, bucket=bucket, listing_count=count)
+         for location, pairs in buckets.items() for bucket, count in pairs],
+        batch_size=5000)
+    return len(stats)
@@ -0,0 +1,227 @@
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+# How long a process trusts a "no index yet" answer before asking again
+INDEX_CHECK_TTL = 60
+
+_index_ready = {}
+
+
+def words(text):
+    return WORD_RE.findall(text or '')
+
+
+class LikeSearchBackend:
+    """LIKE '%term%' matching; works everywhere but cannot use an index."""
+    search_fields = ('title', 'location', 'description')
+
+    def ensure_index(self):
+        pass
+
+    def index_exists(self):
+        return True
+
+    def search(self, queryset, terms):
+        for term in terms:
+            condition = Q()
+            for field in self.search_fields:
+                condition |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(condition)
+        return queryset
+
+    def filter_location(self, queryset, location):
+        return queryset.filter(location__icontains=location)
+
+
+class MySQLFullTextBackend:
+    """InnoDB FULLTEXT indexes, which MySQL keeps in sync on every write."""
+    # innodb_ft_min_token_size; shorter words are never indexed
+    min_word_length = 3
+    search_index = 'listing_search_ft'
+    location_index = 'listing_location_ft'
+    search_columns = 'title, location, description'
+
+    def existing_indexes(self, cursor):
+        cursor.execute(
+            "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'listings_listing'"
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def index_exists(self):
+        with connection.cursor() as cursor:
+            existing = self.existing_indexes(cursor)
+        return {self.search_index, self.location_index} <= existing
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            existing = self.existing_indexes(cursor)
+            if self.search_index not in existing:
+                cursor.execute(
+                    f"ALTER TABLE listings_listing ADD FULLTEXT INDEX "
+                    f"{self.search_index} ({self.search_columns})")
+            if self.location_index not in existing:
+                cursor.execute(
+                    f"ALTER TABLE listings_listing ADD FULLTEXT INDEX "
+                    f"{self.location_index} (location)")
+
+    def boolean_query(self, terms):
+        # Every word must match, each as a prefix
+        return ' '.join(f'+{word}*' for term in terms for word in words(term)
+                        if len(word) >= self.min_word_length)
+
+    def search(self, queryset, terms):
+        query = self.boolean_query(terms)
+        if not query:
+            return LikeSearchBackend().search(queryset, terms)
+        match = f"MATCH ({self.search_columns}) AGAINST (%s IN BOOLEAN MODE)"
+        return queryset.annotate(
+            search_rank=RawSQL(match, [query], output_field=FloatField())
+        ).filter(search_rank__gt=0)
+
+    def filter_location(self, queryset, location):
+        query = self.boolean_query([location])
+        if not query:
+            return LikeSearchBackend().filter_location(queryset, location)
+        match = "MATCH (location) AGAINST (%s IN BOOLEAN MODE)"
+        return queryset.alias(
+            location_rank=RawSQL(match, [query], output_field=FloatField())
+        ).filter(location_rank__gt=0)
+
+
+class SQLiteFTSBackend:
+    """
+    FTS5 table over the listing text columns for local development. It is
+    an external-content table kept in sync by triggers, so every write to
+    listings_listing updates it.
+    """
+    table = 'listings_listing_fts'
+
+    def index_exists(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [self.table])
+            return cursor.fetchone() is not None
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                f"title, location, description, "
+                f"content='listings_listing', content_rowid='id')")
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {self.table}_ai AFTER INSERT ON listings_listing BEGIN "
+                f"INSERT INTO {self.table}(rowid, title, location, description) "
+                f"VALUES (new.id, new.title, new.location, new.description); END")
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {self.table}_ad AFTER DELETE ON listings_listing BEGIN "
+                f"INSERT INTO {self.table}({self.table}, rowid, title, location, description) "
+                f"VALUES ('delete', old.id, old.title, old.location, old.description); END")
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {self.table}_au AFTER UPDATE ON listings_listing BEGIN "
+                f"INSERT INTO {self.table}({self.table}, rowid, title, location, description) "
+                f"VALUES ('delete', old.id, old.title, old.location, old.description); "
+                f"INSERT INTO {self.table}(rowid, title, location, description) "
+                f"VALUES (new.id, new.title, new.location, new.description); END")
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def match_query(self, terms, column=None):
+        query = ' '.join(f'"{word}"*' for term in terms for word in words(term))
+        if query and column:
+            query = f'{column} : ({query})'
+        return query
+
+    def search(self, queryset, terms):
+        query = self.match_query(terms)
+        if not query:
+            return queryset
+        # Joined on rowid, so the MATCH runs once and drives the query;
+        # bm25() is lower for better matches, negated so higher is better
+        return queryset.extra(
+            select={'search_rank': f'-bm25({self.table})'},
+            tables=[self.table],
+            where=[f'{self.table}.rowid = listings_listing.id', f'{self.table} MATCH %s'],
+            params=[query])
+
+    def filter_location(self, queryset, location):
+        query = self.match_query([location], column='location')
+        if not query:
+            return queryset
+        matches = f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s"
+        return queryset.filter(id__in=RawSQL(matches, [query]))
+
+
+def ranked(queryset):
+    """Whether a backend's search() gave `queryset` a search_rank to order by."""
+    return ('search_rank' in queryset.query.annotations
+            or 'search_rank' in queryset.query.extra_select)
+
+
+def configured_search_backend():
+    """The backend for this database, whether or not its index exists yet."""
+    path = getattr(settings, 'LISTINGS_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'mysql':
+        return MySQLFullTextBackend()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSBackend()
+    return LikeSearchBackend()
+
+
+def index_ready(backend):
+    """
+    Whether `backend`'s index has been built (build_search_index). Once
+    found it is assumed to stay; a missing one is looked for again after
+    INDEX_CHECK_TTL seconds.
+    """
+    key = (connection.alias, type(backend))
+    ready, checked = _index_ready.get(key, (False, None))
+    if not ready and (checked is None or time.monotonic() - checked >= INDEX_CHECK_TTL):
+        ready = backend.index_exists()
+        _index_ready[key] = (ready, time.monotonic())
+        if not ready:
+            logger.warning('%s index missing, searching with LIKE until '
+                           'build_search_index is run', type(backend).__name__)
+    return ready
+
+
+def get_search_backend():
+    """
+    The configured backend, or LIKE matching while its index is missing so
+    searches stay slow but correct instead of failing.
+    """
+    backend = configured_search_backend()
+    if hasattr(backend, 'index_exists') and not index_ready(backend):
+        return LikeSearchBackend()
+    return backend
+
+
+class ListingSearchFilter(SearchFilter):
+    """
+    `?search=` through the configured search backend. Without an explicit
+    `?ordering=` the results come back best match first.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        queryset = get_search_backend().search(queryset, terms)
+        if ranked(queryset) and not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank', '-id')
+        return queryset
@@ -1,5 +1,30 @@
+from django.db.models import OuterRef, Subquery
 from rest_framework import serializers
-from .models import Listing, Host, ListingImage, Amenity, ListingAmenity
+from .models import Listing, Host, ListingImage, Amenity, LocationStats
+
+# Nested relations ?expand= can ask for
+EXPANDABLE_FIELDS = ('host', 'images', 'amenities')
+
+# The ?view=summary representation, built from .values() rows
+SUMMARY_FIELDS = (
+    'id', 'title', 'location', 'price_per_night', 'currency', 'rating',
+    'reviews_count', 'primary_image',
+)
+SUMMARY_DECIMAL_FIELDS = ('price_per_night', 'rating')
+
+
+class SparseFieldsMixin:
+    """
+    Takes a `fields` keyword listing the fields to keep; the others are
+    removed before serialization, so they are never computed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
 class HostSerializer(serializers.ModelSerializer):
@@ -20,7 +45,7 @@ class AmenitySerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class ListingSerializer(serializers.ModelSerializer):
+class ListingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     host = HostSerializer(read_only=True)
     images = ListingImageSerializer(many=True, read_only=True)
     amenities = serializers.SerializerMethodField()
@@ -35,13 +60,54 @@ class ListingSerializer(serializers.ModelSerializer):
         ]
 
     def get_amenities(self, obj):
-        amenities = Amenity.objects.filter(
-            id__in=ListingAmenity.objects.filter(
-                listing=obj).values_list('amenity_id', flat=True)
-        )
+        # Uses the listing_amenities prefetch from ListingViewSet.get_queryset
+        amenities = sorted(
+            (listing_amenity.amenity for listing_amenity in obj.listing_amenities.all()),
+            key=lambda amenity: amenity.id)
         return AmenitySerializer(amenities, many=True).data
 
 
 class ListingDetailSerializer(ListingSerializer):
     class Meta(ListingSerializer.Meta):
         pass
+
+
+class LocationStatsSerializer(serializers.ModelSerializer):
+    avg_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    avg_rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
+    superhost_share = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = LocationStats
+        fields = [
+            'location', 'listing_count', 'avg_price', 'median_price',
+            'p90_price', 'avg_rating', 'superhost_share', 'updated_at'
+        ]
+
+
+def summary_queryset(queryset):
+    """
+    `queryset` as .values() rows carrying the summary fields, with the
+    primary image picked by a correlated subquery instead of a prefetch.
+    created_at is kept for pagination.
+    """
+    primary_image = (ListingImage.objects.filter(listing=OuterRef('pk'))
+                     .order_by('-is_primary', 'id').values('image_url')[:1])
+    columns = [field for field in SUMMARY_FIELDS if field != 'primary_image']
+    return queryset.values(*columns, 'created_at',
+                           primary_image=Subquery(primary_image))
+
+
+def summarize(rows, fields=None):
+    """Summary representations of summary_queryset rows, without DRF fields."""
+    fields = fields or SUMMARY_FIELDS
+    decimals = [field for field in SUMMARY_DECIMAL_FIELDS if field in fields]
+    data = []
+    for row in rows:
+        item = {field: row[field] for field in fields}
+        # Rendered as strings, the same as ListingSerializer
+        for field in decimals:
+            if item[field] is not None:
+                item[field] = str(item[field])
+        data.append(item)
+    return data
@@ -0,0 +1,149 @@
+import base64
+import json
+from datetime import date, datetime, timezone
+
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from airbnb_scraper.db import night_masks
+
+from .availability import settle_searched_nights
+from .cache import data_version, forget_data_version, get_cache
+from .models import (Amenity, DataVersion, Host, Listing, ListingAmenity,
+                     ListingAvailability, ListingImage)
+
+
+class ListingListQueryCountTests(APITestCase):
+    """
+    A page of listings costs the same queries however many it holds: the
+    count, the page itself, and one prefetch each for images and amenities.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = Host.objects.create(name='Test host')
+        cls.amenities = [Amenity.objects.create(name=name)
+                         for name in ('Wifi', 'Kitchen', 'Pool')]
+
+    def setUp(self):
+        get_cache().clear()
+        # Read (and keep) the data version now, so it is not counted below
+        data_version()
+
+    def add_listings(self, count):
+        for i in range(count):
+            listing = Listing.objects.create(
+                title=f'Listing {i}', location='Lisbon', price_per_night=100 + i,
+                host=self.host)
+            ListingImage.objects.create(
+                listing=listing, image_url=f'https://example.com/{i}.jpg', is_primary=True)
+            for amenity in self.amenities:
+                ListingAmenity.objects.create(listing=listing, amenity=amenity)
+        # As the scraper does, so the next request misses the response cache;
+        # the new version is read here rather than inside the request
+        DataVersion.bump()
+        forget_data_version()
+        data_version()
+
+    def assert_page_queries(self, expected_results):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('listing-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), expected_results)
+        return response
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.add_listings(2)
+        self.assert_page_queries(2)
+
+        # A full page of 20 listings, each with an image and three amenities
+        self.add_listings(23)
+        response = self.assert_page_queries(20)
+        self.assertEqual(len(response.data['results'][0]['amenities']), 3)
+        self.assertEqual(len(response.data['results'][0]['images']), 1)
+
+
+class ListingCursorTests(APITestCase):
+    """Cursors are client input; malformed ones are a 404, not a 500."""
+
+    @classmethod
+    def setUpTestData(cls):
+        host = Host.objects.create(name='Test host')
+        for i in range(3):
+            Listing.objects.create(title=f'Listing {i}', location='Lisbon',
+                                   price_per_night=100 + i, host=host)
+
+    def setUp(self):
+        get_cache().clear()
+
+    def get_page(self, ordering, value):
+        payload = json.dumps({'o': ordering, 'v': value, 'p': 1})
+        cursor = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return self.client.get(reverse('listing-list'),
+                               {'ordering': ordering, 'cursor': cursor})
+
+    def test_cursor_value_that_does_not_fit_the_field_is_not_found(self):
+        for ordering, value in (('price_per_night', 'cheap'), ('price_per_night', [1]),
+                                ('-created_at', 'yesterday'), ('rating', {'a': 1})):
+            with self.subTest(ordering=ordering, value=value):
+                response = self.get_page(ordering, value)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_valid_cursor_continues_after_its_position(self):
+        response = self.get_page('price_per_night', '100.00')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['price_per_night'] for row in response.data['results']],
+                         ['101.00', '102.00'])
+
+
+class SettleSearchedNightsTests(TestCase):
+    """
+    After a crawl, the nights it searched are kept only where it found the
+    listing free; everything outside the searched window is left alone.
+    """
+    earlier = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    crawl = datetime(2030, 1, 2, tzinfo=timezone.utc)
+    later = datetime(2030, 1, 3, tzinfo=timezone.utc)
+    month = date(2030, 2, 1)
+    # Searched: the nights of the 10th, 11th and 12th
+    window = night_masks(date(2030, 2, 10), date(2030, 2, 13))[month]
+    outside = 1 << 0 | 1 << 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = Host.objects.create(name='Test host')
+
+    def add_row(self, location='Lisbon', max_guests=4, **fields):
+        listing = Listing.objects.create(
+            title='Listing', location=location, price_per_night=100, host=self.host,
+            max_guests=max_guests)
+        return ListingAvailability.objects.create(listing=listing, month=self.month, **fields)
+
+    def settle(self):
+        return settle_searched_nights(
+            [('Lisbon', date(2030, 2, 10), date(2030, 2, 13), 2)], self.crawl)
+
+    def assert_days(self, row, days):
+        row.refresh_from_db()
+        self.assertEqual(row.days, days)
+
+    def test_settles_only_the_searched_window(self):
+        found = self.add_row(days=self.outside | self.window, observed_at=self.crawl,
+                             observed_days=self.window & ~(1 << 10))
+        missing = self.add_row(days=self.outside | self.window, observed_at=self.earlier)
+        too_small = self.add_row(days=self.window, observed_at=self.earlier, max_guests=1)
+        elsewhere = self.add_row(days=self.window, observed_at=self.earlier, location='Porto')
+        newer = self.add_row(days=self.window, observed_at=self.later)
+
+        self.assertEqual(self.settle(), 2)
+        self.assert_days(found, self.outside | self.window & ~(1 << 10))
+        self.assert_days(missing, self.outside)
+        self.assert_days(too_small, self.window)
+        self.assert_days(elsewhere, self.window)
+        self.assert_days(newer, self.window)
+
+        # Items of the crawl loaded afterwards (from a spool) add their nights back
+        missing.refresh_from_db()
+        self.assertEqual((missing.observed_at, missing.observed_days), (self.crawl, 0))
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ListingViewSet
+from .views import ListingViewSet, LocationStatsView
 
 router = DefaultRouter()
 router.register(r'listings', ListingViewSet)
 
 urlpatterns = [
+    path('locations/stats/', LocationStatsView.as_view(), name='location-stats'),
     path('', include(router.urls)),
 ]
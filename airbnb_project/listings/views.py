@@ -1,43 +1,271 @@
-from rest_framework import viewsets, filters
+from rest_framework import generics, viewsets, filters
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Listing
-from .serializers import ListingSerializer, ListingDetailSerializer
+from .amenity_index import filter_amenities
+from .availability import MAX_NIGHTS, filter_available
+from .cache import CachedResponseMixin, cache_metrics
+from .export import EXPORT_FORMATS, iter_chunks
+from .facets import facet_counts
+from .models import Listing, ListingAmenity, LocationStats
+from .price_history import DEFAULT_POINTS, MAX_POINTS, observation_history
+from .pagination import ListingKeysetPagination
+from .search import ListingSearchFilter, get_search_backend
+from .serializers import (
+    EXPANDABLE_FIELDS, SUMMARY_FIELDS, ListingSerializer,
+    ListingDetailSerializer, LocationStatsSerializer, summarize,
+    summary_queryset,
+)
 
 
-class ListingViewSet(viewsets.ReadOnlyModelViewSet):
+class ListingViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Listing.objects.all().order_by('-created_at')
     filter_backends = [DjangoFilterBackend,
-                       filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['location', 'property_type']
+                       ListingSearchFilter, filters.OrderingFilter]
+    # ?location= is matched word by word through the search index in
+    # get_list_queryset rather than as an exact filter here
+    filterset_fields = ['property_type']
     search_fields = ['title', 'location', 'description']
     ordering_fields = ['price_per_night', 'rating', 'reviews_count']
 
+    @property
+    def paginator(self):
+        # Passing ?cursor= (empty for the first page) switches to keyset
+        # pagination, for clients walking the whole collection
+        if not hasattr(self, '_paginator'):
+            if ListingKeysetPagination.cursor_query_param in self.request.query_params:
+                self._paginator = ListingKeysetPagination()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.is_summary():
+            return queryset
+
+        # Load hosts, images and amenities up front so serializing a page
+        # costs a fixed number of queries however many listings it holds;
+        # relations left out of ?fields= are not loaded at all
+        fields = self.requested_fields()
+        if fields is None or 'host' in fields:
+            queryset = queryset.select_related('host')
+        if fields is None or 'images' in fields:
+            queryset = queryset.prefetch_related('images')
+        if fields is None or 'amenities' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch('listing_amenities',
+                         queryset=ListingAmenity.objects.select_related('amenity')))
+        if fields is not None and 'description' not in fields:
+            queryset = queryset.defer('description')
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ListingDetailSerializer
         return ListingSerializer
 
-    def list(self, request, *args, **kwargs):
+    def is_summary(self):
+        return self.action == 'list' and \
+            self.request.query_params.get('view') == 'summary'
+
+    def query_param_list(self, name):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        return [part.strip() for part in value.split(',') if part.strip()]
+
+    def requested_fields(self):
+        """
+        Field names selected by ?fields= and ?expand=, or None for the full
+        representation. ?fields= picks fields, nested ones included; ?expand=
+        adds nested relations, on top of every plain field when ?fields= is
+        absent.
+        """
+        if hasattr(self, '_requested_fields'):
+            return self._requested_fields
+
+        fields = self.query_param_list('fields')
+        expand = self.query_param_list('expand')
+        if self.is_summary():
+            available, expandable = SUMMARY_FIELDS, ()
+        else:
+            available, expandable = ListingSerializer.Meta.fields, EXPANDABLE_FIELDS
+
+        errors = {}
+        unknown = [field for field in fields or () if field not in available]
+        if unknown:
+            errors['fields'] = [f'Unknown field: {field}' for field in unknown]
+        unknown = [field for field in expand or () if field not in expandable]
+        if unknown:
+            errors['expand'] = [f'Cannot expand: {field}' for field in unknown]
+        if errors:
+            raise ValidationError(errors)
+
+        if fields is None and expand is None:
+            selected = None
+        else:
+            if fields is None:
+                fields = [field for field in available if field not in expandable]
+            selected = set(fields) | set(expand or ())
+            selected = [field for field in available if field in selected]
+        self._requested_fields = selected
+        return selected
+
+    def get_list_queryset(self):
         # Handle custom query parameters
-        location = request.query_params.get('location')
-        check_in = request.query_params.get('check_in')
-        check_out = request.query_params.get('check_out')
-        guests = request.query_params.get('guests')
+        location = self.request.query_params.get('location')
+        check_in = self.request.query_params.get('check_in')
+        check_out = self.request.query_params.get('check_out')
+        guests = self.request.query_params.get('guests')
 
         queryset = self.filter_queryset(self.get_queryset())
 
         # Apply additional filters based on custom parameters
         if location:
-            queryset = queryset.filter(location__icontains=location)
+            queryset = get_search_backend().filter_location(queryset, location)
+
+        if check_in or check_out:
+            check_in, check_out = self.parse_stay(check_in, check_out)
+            queryset = filter_available(queryset, check_in, check_out)
+
+        if guests:
+            try:
+                guests = int(guests)
+            except ValueError:
+                raise ValidationError({'guests': ['Must be a whole number']})
+            queryset = queryset.filter(max_guests__gte=guests)
+
+        amenities = self.query_param_list('amenities')
+        if amenities:
+            mode = self.request.query_params.get('amenities_mode', 'all')
+            if mode not in ('all', 'any'):
+                raise ValidationError({'amenities_mode': ['Choose all or any']})
+            queryset = filter_amenities(queryset, amenities, match_all=mode == 'all')
+
+        return queryset
+
+    def parse_stay(self, check_in, check_out):
+        errors = {}
+        dates = {}
+        for name, value in (('check_in', check_in), ('check_out', check_out)):
+            try:
+                dates[name] = parse_date(value or '')
+            except ValueError:
+                dates[name] = None
+            if dates[name] is None:
+                errors[name] = ['Expected a date as YYYY-MM-DD']
+        if errors:
+            raise ValidationError(errors)
 
-        # Note: In a real app, you would handle check_in, check_out, and guests
-        # by querying availability data
+        nights = (dates['check_out'] - dates['check_in']).days
+        if not 0 < nights <= MAX_NIGHTS:
+            raise ValidationError(
+                {'check_out': [f'Must be 1 to {MAX_NIGHTS} nights after check_in']})
+        return dates['check_in'], dates['check_out']
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self.list_response)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(ListingViewSet, self).retrieve(request, *args, **kwargs))
+
+    @action(detail=False, url_path='export')
+    def export(self, request):
+        # ?as= rather than ?format=, which DRF reserves for its renderers
+        export_as = request.query_params.get('as', 'ndjson')
+        if export_as not in EXPORT_FORMATS:
+            raise ValidationError(
+                {'as': [f'Choose one of: {", ".join(EXPORT_FORMATS)}']})
+
+        content_type, extension, stream = EXPORT_FORMATS[export_as]
+        response = StreamingHttpResponse(
+            stream(iter_chunks(self.get_list_queryset())), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="listings.{extension}"'
+        return response
+
+    @action(detail=False, url_path='facets')
+    def facets(self, request):
+        # Cached per data version like list responses
+        return self.cached_response(
+            request, lambda: Response(facet_counts(self.get_list_queryset())))
+
+    @action(detail=True, url_path='price-history')
+    def price_history(self, request, pk=None):
+        return self.cached_response(request, lambda: self.price_history_response(pk))
+
+    def price_history_response(self, pk):
+        listing = get_object_or_404(Listing.objects.only('id'), pk=pk)
+        params = self.request.query_params
+
+        errors = {}
+        dates = {}
+        for name in ('start', 'end'):
+            try:
+                dates[name] = parse_date(params[name]) if params.get(name) else None
+            except ValueError:
+                dates[name] = None
+            if params.get(name) and dates[name] is None:
+                errors[name] = ['Expected a date as YYYY-MM-DD']
+        try:
+            points = int(params.get('points', DEFAULT_POINTS))
+        except ValueError:
+            points = 0
+        if not 1 < points <= MAX_POINTS:
+            errors['points'] = [f'Must be between 2 and {MAX_POINTS}']
+        if errors:
+            raise ValidationError(errors)
+
+        history = observation_history(listing, dates['start'], dates['end'], points)
+        return Response({'listing': listing.pk, 'results': history})
+
+    @action(detail=False, url_path='cache-stats')
+    def cache_stats(self, request):
+        return Response(cache_metrics())
+
+    def list_response(self):
+        queryset = self.get_list_queryset()
+        summary = self.is_summary()
+        if summary:
+            # ?view=summary skips model instances and serializer fields
+            queryset = summary_queryset(queryset)
 
         page = self.paginate_queryset(queryset)
+        rows = queryset if page is None else page
+        if summary:
+            data = summarize(rows, self.requested_fields())
+        else:
+            data = self.get_serializer(rows, many=True).data
+
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(data)
+        return Response(data)
+
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+class LocationStatsView(generics.ListAPIView):
+    """
+    Precomputed per-location stats, largest locations first. `?location=`
+    returns a single location by its unique key.
+    """
+    serializer_class = LocationStatsSerializer
+
+    def get_queryset(self):
+        queryset = LocationStats.objects.order_by('-listing_count', 'location')
+        location = self.request.query_params.get('location')
+        if location:
+            queryset = queryset.filter(location=location)
+        return queryset
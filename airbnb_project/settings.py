@@ -103,6 +103,24 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Caches; the listings API caches responses in LISTINGS_CACHE_ALIAS
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'listings': {
+        'BACKEND': os.getenv('LISTINGS_CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('LISTINGS_CACHE_LOCATION', 'listings'),
+    },
+}
+LISTINGS_CACHE_ALIAS = 'listings'
+LISTINGS_CACHE_TIMEOUT = int(os.getenv('LISTINGS_CACHE_TIMEOUT', '3600'))
+LISTINGS_DATA_VERSION_TTL = 5
+
+# Rows read per query by /api/listings/export/
+LISTINGS_EXPORT_CHUNK_SIZE = 2000
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
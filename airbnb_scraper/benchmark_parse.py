@@ -0,0 +1,265 @@
+import gzip
+import json
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from scrapy import Request
+from scrapy.crawler import Crawler
+from scrapy.http import HtmlResponse
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.project import data_path, get_project_settings
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from airbnb_scraper.search_state import SearchState  # noqa: E402
+from airbnb_scraper.spiders.airbnb_spider import AirbnbSpider  # noqa: E402
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Fixed search parameters, so the items do not change with the day the
+# benchmark is run on and compare equal to their golden files
+SEARCH_ARGS = {'check_in': '2030-01-07', 'check_out': '2030-01-12', 'guests': '2',
+               'crawl_started': '2030-01-01T00:00:00+00:00'}
+# Set from the clock on every item; left out of the outputs
+VOLATILE_FIELDS = ('scraped_at',)
+
+
+def read_body(path):
+    with open(path, 'rb') as f:
+        body = f.read()
+    # HTTPCACHE_GZIP stores every file gzipped
+    return gzip.decompress(body) if body.startswith(GZIP_MAGIC) else body
+
+
+def httpcache_pages(cache_dir):
+    """
+    (key, url, body) of the successful responses in a filesystem HTTP cache
+    directory; the key is the entry's request fingerprint.
+    """
+    for root, dirs, files in os.walk(cache_dir):
+        dirs.sort()
+        if 'pickled_meta' not in files or 'response_body' not in files:
+            continue
+        meta = pickle.loads(read_body(os.path.join(root, 'pickled_meta')))
+        if meta.get('status', 200) != 200:
+            continue
+        yield (os.path.basename(root), meta.get('response_url') or meta['url'],
+               read_body(os.path.join(root, 'response_body')))
+
+
+def saved_pages(pages_dir):
+    """
+    (key, url, body) of saved pages: every `<name>.html` with a `<name>.url`
+    next to it holding the URL the page was fetched from.
+    """
+    for name in sorted(os.listdir(pages_dir)):
+        stem, ext = os.path.splitext(name)
+        url_path = os.path.join(pages_dir, stem + '.url')
+        if ext != '.html' or not os.path.exists(url_path):
+            continue
+        with open(url_path, encoding='utf-8') as f:
+            url = f.read().strip()
+        with open(os.path.join(pages_dir, name), 'rb') as f:
+            yield stem, url, f.read()
+
+
+def page_kind(url):
+    if '/rooms/' in url:
+        return 'listing'
+    if '/s/' in url:
+        return 'search'
+    return None
+
+
+def make_spider(settings, search_only):
+    crawler = Crawler(AirbnbSpider, settings)
+    spider = AirbnbSpider.from_crawler(
+        crawler, search_only='1' if search_only else None, **SEARCH_ARGS)
+    crawler.stats = MemoryStatsCollector(crawler)
+    if search_only:
+        # Never saved: every room counts as new, so each card asks for its detail page
+        spider.search_state = SearchState(os.devnull)
+    return spider
+
+
+def run_callback(spider, kind, url, body):
+    # A fresh response per run, so its HTML is parsed again every time
+    response = HtmlResponse(url=url, body=body, encoding='utf-8')
+    if kind == 'listing':
+        return list(spider.parse_listing(response))
+    return list(spider.parse_search_results(response))
+
+
+def callback_output(results):
+    """The items and follow-up requests of a callback, as plain JSON data."""
+    items, requests = [], []
+    for result in results:
+        if isinstance(result, Request):
+            requests.append({'url': result.url,
+                             'callback': getattr(result.callback, '__name__', None)})
+        else:
+            items.append({field: value for field, value in dict(result).items()
+                          if field not in VOLATILE_FIELDS})
+    # Round trip so the output compares equal to a golden file read back
+    return json.loads(json.dumps({'items': items, 'requests': requests},
+                                 sort_keys=True, default=str))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def check_golden(golden_dir, key, output, write):
+    """
+    'ok', 'written' or 'missing' for one page's output, or the sorted
+    fields that differ from its golden file.
+    """
+    path = os.path.join(golden_dir, key + '.json')
+    if write:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 'written'
+    try:
+        with open(path, encoding='utf-8') as f:
+            golden = json.load(f)
+    except FileNotFoundError:
+        return 'missing'
+    if golden == output:
+        return 'ok'
+
+    fields = set()
+    if golden['requests'] != output['requests']:
+        fields.add('<requests>')
+    if len(golden['items']) != len(output['items']):
+        fields.add('<item count>')
+    for expected, actual in zip(golden['items'], output['items']):
+        fields.update(field for field in expected.keys() | actual.keys()
+                      if expected.get(field) != actual.get(field))
+    return sorted(fields) or ['<output>']
+
+
+def run_benchmark(httpcache_dir=None, pages_dir=None, golden_dir=None,
+                  write_golden=False, repeat=5, search_only=False):
+    """
+    Replay recorded search and listing pages through the spider callbacks,
+    without any network, and report parse throughput, latency percentiles
+    and the peak memory traced while parsing a page. With `golden_dir`, each page's items and
+    follow-up requests are also compared against (or written to) its
+    golden file.
+    """
+    settings = get_project_settings()
+    if pages_dir:
+        pages = list(saved_pages(pages_dir))
+    else:
+        httpcache_dir = httpcache_dir or os.path.join(
+            data_path(settings.get('HTTPCACHE_DIR', 'httpcache')), AirbnbSpider.name)
+        pages = list(httpcache_pages(httpcache_dir))
+    pages = [(key, url, body, page_kind(url)) for key, url, body in pages]
+    pages = [page for page in pages if page[3]]
+    if not pages:
+        print('No search or listing pages found to replay')
+        return {}
+
+    spider = make_spider(settings, search_only)
+    repeat = max(repeat, 1)
+    if golden_dir and write_golden:
+        os.makedirs(golden_dir, exist_ok=True)
+
+    timings = defaultdict(list)
+    peaks = defaultdict(list)
+    counts = defaultdict(lambda: {'pages': 0, 'items': 0, 'requests': 0})
+    golden = defaultdict(list)
+
+    for key, url, body, kind in pages:
+        # Correctness and peak memory first, in a run of their own: tracing
+        # slows every allocation down and would skew the timings
+        tracemalloc.start()
+        output = callback_output(run_callback(spider, kind, url, body))
+        peaks[kind].append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        counts[kind]['pages'] += 1
+        counts[kind]['items'] += len(output['items'])
+        counts[kind]['requests'] += len(output['requests'])
+        if golden_dir:
+            status = check_golden(golden_dir, key, output, write_golden)
+            if isinstance(status, list):
+                print(f"MISMATCH {key} ({url}): {', '.join(status)}")
+                status = 'mismatch'
+            elif status == 'missing':
+                print(f"MISSING {key} ({url}): no golden file")
+            golden[status].append(key)
+
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run_callback(spider, kind, url, body)
+            timings[kind].append(time.perf_counter() - started)
+
+    report = {}
+    for kind, samples in sorted(timings.items()):
+        elapsed = sum(samples)
+        report[kind] = {
+            'pages': counts[kind]['pages'],
+            'items': counts[kind]['items'],
+            'requests': counts[kind]['requests'],
+            'pages_per_second': round(len(samples) / elapsed, 1) if elapsed else None,
+            'items_per_second': round(counts[kind]['items'] * repeat / elapsed, 1)
+            if elapsed else None,
+            'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+            'peak_traced_kib': round(sum(peaks[kind]) / len(peaks[kind]) / 1024, 1),
+        }
+        row = report[kind]
+        print(f"{kind:8} {row['pages']:6} pages  {row['pages_per_second']:>9} pages/s  "
+              f"{row['items_per_second']:>9} items/s  p50 {row['p50_ms']:.3f}ms  "
+              f"p99 {row['p99_ms']:.3f}ms  peak traced {row['peak_traced_kib']} KiB/page")
+
+    if golden_dir:
+        report['golden'] = {status: len(keys) for status, keys in golden.items()}
+        print('golden: ' + ', '.join(f'{count} {status}'
+                                     for status, count in sorted(report['golden'].items())))
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the spider callbacks on recorded pages, offline')
+    parser.add_argument('--httpcache', type=str,
+                        help='HTTP cache directory to replay (defaults to the '
+                             "project's HTTPCACHE_DIR for the airbnb spider)")
+    parser.add_argument('--pages', type=str,
+                        help='Directory of saved <name>.html pages, each with a '
+                             '<name>.url file; used instead of the HTTP cache')
+    parser.add_argument('--golden', type=str,
+                        help='Directory of golden outputs to check extraction against')
+    parser.add_argument('--write-golden', action='store_true',
+                        help='Write the current outputs as the golden files instead')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Timed runs per page')
+    parser.add_argument('--search-only', action='store_true',
+                        help='Parse search pages the way search-only crawls do')
+
+    args = parser.parse_args()
+    if args.write_golden and not args.golden:
+        parser.error('--write-golden needs --golden')
+
+    report = run_benchmark(
+        httpcache_dir=args.httpcache,
+        pages_dir=args.pages,
+        golden_dir=args.golden,
+        write_golden=args.write_golden,
+        repeat=args.repeat,
+        search_only=args.search_only
+    )
+    # A page without a golden file is unchecked, which fails the check too
+    golden = report.get('golden', {})
+    if golden.get('mismatch') or golden.get('missing'):
+        sys.exit(1)
@@ -0,0 +1,1040 @@
+import hashlib
+import json
+import math
+import queue
+import random
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+# Columns that are NOT NULL on the listings tables; items missing any of them
+# would fail the whole batch they are written with.
+REQUIRED_FIELDS = ('title', 'location', 'price_per_night', 'host_name')
+
+# MySQL errors after which the whole transaction can simply be run again:
+# ER_LOCK_DEADLOCK and ER_LOCK_WAIT_TIMEOUT
+RETRYABLE_ERRNOS = (1213, 1205)
+
+# LocationPriceBucket sizes as (upper price limit, bucket width); also used
+# by listings.rollups to rebuild the buckets in SQL
+BUCKET_STEPS = ((1000, 5), (5000, 50), (None, 500))
+
+# Columns written for every new or changed listing
+LISTING_COLUMNS = (
+    'airbnb_id', 'title', 'location', 'address', 'price_per_night', 'currency',
+    'total_price', 'rating', 'description', 'reviews_count', 'property_type',
+    'host_id', 'content_hash', 'amenity_bits',
+)
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def utc_now():
+    # Django stores naive UTC datetimes in MySQL when USE_TZ is enabled
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def host_key(row):
+    if row['host_airbnb_id']:
+        return ('airbnb', row['host_airbnb_id'])
+    return ('name', row['host_name'])
+
+
+def listing_key(row):
+    if row['airbnb_id']:
+        return ('airbnb', row['airbnb_id'])
+    return ('natural', row['title'], row['location'], row['host_id'])
+
+
+def content_hash(row):
+    """Stable fingerprint of everything a listing row would write."""
+    normalized = dict(row, amenities=sorted(set(row['amenities'])))
+    payload = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def amenity_bits(amenity_ids):
+    """
+    Bitset with bit n set for amenity id n, as little-endian bytes; the
+    format of Listing.amenity_bits, also used by the listings app.
+    """
+    bits = 0
+    for amenity_id in amenity_ids:
+        bits |= 1 << amenity_id
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def bucket_width(bucket):
+    """Width of the price bucket starting at `bucket` (or holding a price)."""
+    for limit, step in BUCKET_STEPS:
+        if limit is None or bucket < limit:
+            return step
+
+
+def price_bucket(price):
+    """
+    Lower bound of the LocationPriceBucket holding `price`: $5 wide below
+    $1,000, $50 wide below $5,000 and $500 wide above.
+    """
+    price = Decimal(str(price))
+    step = bucket_width(price)
+    return int(price // step * step)
+
+
+def bucket_percentile(buckets, fraction):
+    """
+    Midpoint of the bucket holding the `fraction` quantile, from sorted
+    (bucket, count) pairs.
+    """
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+    rank = max(1, math.ceil(total * fraction))
+    seen = 0
+    for bucket, count in buckets:
+        seen += count
+        if seen >= rank:
+            return Decimal(bucket) + Decimal(bucket_width(bucket)) / 2
+    return None
+
+
+def to_cents(value):
+    """`value` as a two-place Decimal, so floats and stored values compare."""
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def night_masks(check_in, check_out):
+    """
+    The nights from check_in up to (not including) check_out as
+    {first day of month: bitmask}, bit 0 being the 1st of the month, as in
+    ListingAvailability.days. Takes dates or ISO date strings; either
+    being invalid gives no nights.
+    """
+    try:
+        day = date.fromisoformat(str(check_in))
+        end = date.fromisoformat(str(check_out))
+    except ValueError:
+        return {}
+
+    masks = {}
+    while day < end:
+        month = day.replace(day=1)
+        masks[month] = masks.get(month, 0) | 1 << (day.day - 1)
+        day += timedelta(days=1)
+    return masks
+
+
+def to_utc(value):
+    """An ISO timestamp as a naive UTC datetime, None if it is not one."""
+    try:
+        moment = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if moment.tzinfo:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def partial_row(item):
+    """Row for an item built from a search result card alone."""
+    return {
+        'partial': True,
+        'airbnb_id': item.get('airbnb_id'),
+        'price_per_night': item.get('price_per_night'),
+        'total_price': item.get('total_price'),
+        'rating': item.get('rating'),
+        'reviews_count': item.get('reviews_count'),
+        'check_in': item.get('check_in'),
+        'check_out': item.get('check_out'),
+        'guests': to_int(item.get('guests')),
+        'crawl_started': to_utc(item.get('crawl_started')),
+        'scraped_at': to_utc(item.get('scraped_at')),
+    }
+
+
+def item_row(item):
+    """Normalise an item (or ItemAdapter) into the row the writer expects."""
+    if item.get('partial'):
+        return partial_row(item)
+
+    row = {
+        'airbnb_id': item.get('airbnb_id'),
+        'title': item.get('title'),
+        'location': item.get('location'),
+        'address': item.get('address'),
+        'price_per_night': item.get('price_per_night'),
+        'currency': item.get('currency') or 'USD',
+        'total_price': item.get('total_price'),
+        'rating': item.get('rating'),
+        'description': item.get('description'),
+        'reviews_count': item.get('reviews_count') or 0,
+        'property_type': item.get('property_type'),
+        'image_urls': list(item.get('image_urls') or []),
+        'amenities': list(item.get('amenities') or []),
+        'host_airbnb_id': item.get('host_airbnb_id'),
+        'host_name': item.get('host_name'),
+        'host_image': item.get('host_image'),
+        'host_is_superhost': bool(item.get('host_is_superhost')),
+        'host_joined': item.get('host_joined'),
+    }
+    row['content_hash'] = content_hash(row)
+    # The search the listing was found by; it says nothing about the listing
+    # itself, so it stays out of the content hash
+    row['check_in'] = item.get('check_in')
+    row['check_out'] = item.get('check_out')
+    row['guests'] = to_int(item.get('guests'))
+    row['crawl_started'] = to_utc(item.get('crawl_started'))
+    row['scraped_at'] = to_utc(item.get('scraped_at'))
+    return row
+
+
+class LRUCache:
+    """Bounded key -> id map that evicts the least recently used entry."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class ConnectionPool:
+    """Fixed set of DB-API connections shared by the writer threads."""
+
+    def __init__(self, connect, size):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(connect())
+        self.size = size
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self.connections.get().close()
+
+
+def preload_caches(cursor, host_ids, amenity_ids):
+    cursor.execute(
+        "SELECT name, id FROM listings_amenity ORDER BY id LIMIT %s",
+        (amenity_ids.maxsize,)
+    )
+    for name, amenity_id in cursor.fetchall():
+        amenity_ids.set(name, amenity_id)
+
+    # Most recently created hosts are the most likely to be seen again
+    cursor.execute(
+        "SELECT airbnb_id, name, id FROM listings_host ORDER BY id DESC LIMIT %s",
+        (host_ids.maxsize,)
+    )
+    for airbnb_id, name, host_id in reversed(cursor.fetchall()):
+        key = ('airbnb', airbnb_id) if airbnb_id else ('name', name)
+        host_ids.set(key, host_id)
+
+
+def write_transaction(conn, rows, host_ids, amenity_ids, retries=3):
+    """
+    Write `rows` through a BatchWriter in one transaction on `conn` and
+    commit. A batch that loses a deadlock or times out waiting for a lock is
+    rolled back and written again, up to `retries` more times. Returns the
+    writer of the attempt that committed.
+    """
+    attempt = 0
+    while True:
+        cursor = conn.cursor()
+        writer = BatchWriter(cursor, host_ids, amenity_ids)
+        try:
+            writer.write_batch(rows)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            if getattr(e, 'errno', None) not in RETRYABLE_ERRNOS or attempt >= retries:
+                raise
+        else:
+            writer.stats['mysql/transaction_retries'] += attempt
+            return writer
+        finally:
+            cursor.close()
+
+        attempt += 1
+        # Jittered backoff so the writers that collided do not collide again
+        time.sleep(random.uniform(0.05, 0.1) * 2 ** attempt)
+
+
+class BatchWriter:
+    """
+    Writes one batch of item rows to the listings tables through `cursor`.
+    The caller owns the transaction; `stats` holds the counters to report
+    and `discovered` the ids to cache once the batch has committed.
+    """
+
+    def __init__(self, cursor, host_ids, amenity_ids):
+        self.cursor = cursor
+        self.host_ids = host_ids
+        self.amenity_ids = amenity_ids
+        self.stats = Counter()
+        self.discovered = []
+
+    def commit_caches(self):
+        for cache, key, value in self.discovered:
+            cache.set(key, value)
+
+    def write_batch(self, rows):
+        now = utc_now()
+        full = [row for row in rows if not row.get('partial')]
+        partial = [row for row in rows if row.get('partial')]
+
+        listing_ids, listings_changed = {}, False
+        if full:
+            listing_ids, listings_changed = self.write_listings(full, now)
+        if partial:
+            partial_ids, partial_changed = self.write_partial(partial, now)
+            listing_ids.update(partial_ids)
+            listings_changed = listings_changed or partial_changed
+
+        seen = [row for row in rows if listing_key(row) in listing_ids]
+        availability_changed = self.write_availability(seen, listing_ids, now)
+        if listings_changed or availability_changed:
+            self.bump_data_version(now)
+
+    def write_partial(self, rows, now):
+        """
+        Refresh price, rating and review count of stored listings from
+        search result rows. Rows for listings not stored yet are skipped.
+        Returns the ids of the stored ones by listing_key and whether any of
+        them changed.
+        """
+        rows = {row['airbnb_id']: row for row in rows if row['airbnb_id']}
+        airbnb_ids = list(rows)
+        self.cursor.execute(
+            f"""
+            SELECT l.id, l.airbnb_id, l.location, l.price_per_night, l.total_price,
+                   l.rating, l.reviews_count, l.currency, h.is_superhost
+            FROM listings_listing l JOIN listings_host h ON h.id = l.host_id
+            WHERE l.airbnb_id IN ({placeholders(airbnb_ids)})
+            ORDER BY l.id
+            FOR UPDATE OF l
+            """,
+            airbnb_ids
+        )
+
+        listing_ids = {}
+        unchanged_ids = []
+        updates = []
+        stats_changes = []
+        observed = {}
+        for (listing_id, airbnb_id, location, price, total, rating, reviews,
+             currency, superhost) in self.cursor.fetchall():
+            row = rows[airbnb_id]
+            listing_ids[listing_key(row)] = listing_id
+
+            # Fields the card did not carry keep their stored value
+            new = {
+                'price_per_night': price if row['price_per_night'] is None else row['price_per_night'],
+                'total_price': total if row['total_price'] is None else row['total_price'],
+                'rating': rating if row['rating'] is None else row['rating'],
+                'reviews_count': reviews if row['reviews_count'] is None else row['reviews_count'],
+            }
+            if (to_cents(new['price_per_night']), to_cents(new['total_price']),
+                    to_cents(new['rating']), new['reviews_count']) == \
+                    (to_cents(price), to_cents(total), to_cents(rating), reviews):
+                unchanged_ids.append(listing_id)
+                continue
+
+            updates.append((new['price_per_night'], new['total_price'], new['rating'],
+                            new['reviews_count'], now, now, listing_id))
+            stats_changes.append((
+                (location, price, rating, bool(superhost)),
+                dict(new, location=location, host_is_superhost=bool(superhost))))
+            observed[listing_id] = dict(new, currency=currency, scraped_at=row['scraped_at'])
+
+        if unchanged_ids:
+            self.cursor.execute(
+                f"UPDATE listings_listing SET last_seen_at = %s "
+                f"WHERE id IN ({placeholders(unchanged_ids)})",
+                [now] + unchanged_ids
+            )
+        if updates:
+            # In id order, so concurrent batches lock rows in the same order
+            updates.sort(key=lambda update: update[-1])
+            # The stored hash no longer describes the row; cleared, so the
+            # next full item is written in full even if it matches the old one
+            self.cursor.executemany(
+                """
+                UPDATE listings_listing
+                SET price_per_night = %s, total_price = %s, rating = %s,
+                    reviews_count = %s, content_hash = NULL, updated_at = %s,
+                    last_seen_at = %s
+                WHERE id = %s
+                """,
+                updates
+            )
+            self.write_location_stats(*self.location_stats_deltas(stats_changes), now)
+            self.write_price_observations(observed, now)
+
+        self.stats['mysql/partial_updated'] += len(updates)
+        self.stats['mysql/partial_unchanged'] += len(unchanged_ids)
+        self.stats['mysql/partial_unknown'] += len(rows) - len(listing_ids)
+        return listing_ids, bool(updates)
+
+    def write_listings(self, rows, now):
+        """
+        Write the hosts, listings, images and amenities of `rows`. Returns
+        the ids of every listing in the batch by listing_key and whether any
+        of them was written.
+        """
+        # Process host data
+        hosts = {}
+        for row in rows:
+            hosts.setdefault(host_key(row), row)
+        host_ids = self.cached_ids(
+            self.host_ids, 'host', hosts, self.fetch_host_ids)
+
+        new_hosts = [key for key in hosts if key not in host_ids]
+        adopted_hosts = self.adopt_hosts({key: hosts[key] for key in new_hosts})
+        host_ids.update(self.cache_ids(self.host_ids, adopted_hosts))
+        new_hosts = [key for key in new_hosts if key not in adopted_hosts]
+        if new_hosts:
+            self.insert_hosts([hosts[key] for key in new_hosts])
+            host_ids.update(self.cache_ids(
+                self.host_ids, self.fetch_host_ids(new_hosts)))
+
+        # Process listing data; the last copy of a listing in the batch wins
+        listings = {}
+        for row in rows:
+            row['host_id'] = host_ids[host_key(row)]
+            listings[listing_key(row)] = row
+        existing = self.fetch_listings(listings)
+        batch = list(listings)
+        listing_ids = {key: listing_id for key, (listing_id, _) in existing.items()}
+
+        # Rows stored before room ids were scraped are matched by natural key
+        # once and then updated in place so they pick up their room id
+        orphans = {
+            ('natural', row['title'], row['location'], row['host_id']): key
+            for key, row in listings.items()
+            if key[0] == 'airbnb' and key not in existing
+        }
+        adopted = set()
+        if orphans:
+            for natural, (listing_id, _) in self.fetch_listings(
+                    orphans, unclaimed_only=True).items():
+                listing_ids[orphans[natural]] = listing_id
+                adopted.add(orphans[natural])
+
+        # Listings whose content is identical to the stored copy only get
+        # their last-seen time bumped; nothing else about them is written.
+        unchanged = [key for key in listings
+                     if key in existing and existing[key][1] == listings[key]['content_hash']]
+        if unchanged:
+            unchanged_ids = [listing_ids[key] for key in unchanged]
+            self.cursor.execute(
+                f"UPDATE listings_listing SET last_seen_at = %s "
+                f"WHERE id IN ({placeholders(unchanged_ids)})",
+                [now] + unchanged_ids
+            )
+            for key in unchanged:
+                del listings[key]
+
+        self.stats['mysql/items_unchanged'] += len(unchanged)
+
+        if not listings:
+            return {key: listing_ids[key] for key in batch}, False
+
+        # Amenity ids are needed up front for each listing's amenity bitset
+        self.resolve_amenities(listings.values())
+
+        # Location rollups move by the difference between each listing's
+        # stored and new values, so read the stored ones before overwriting,
+        # locked until commit so no concurrent batch computes its difference
+        # from the same stored values. Room ids not stored yet are locked
+        # too: a batch inserting the same listing meanwhile then deadlocks
+        # with this one, and the retry finds the listing stored.
+        previous = {}
+        for listing_id, airbnb_id, state in self.lock_stats_state(
+                [listing_ids[key] for key in listings if key in listing_ids],
+                [key[1] for key in listings if key[0] == 'airbnb' and key not in listing_ids]):
+            previous[listing_id] = state
+            if ('airbnb', airbnb_id) in listings:
+                # Committed by another batch since fetch_listings
+                listing_ids.setdefault(('airbnb', airbnb_id), listing_id)
+        stats_deltas = self.location_stats_deltas(
+            (previous.get(listing_ids.get(key)), row) for key, row in listings.items())
+
+        # Listings with an Airbnb room id go through one upsert on the unique
+        # airbnb_id index, whether they already exist or not
+        upserts = [key for key in listings
+                   if key[0] == 'airbnb' and key not in adopted]
+        if upserts:
+            assignments = ', '.join(
+                f"{column} = VALUES({column})" for column in LISTING_COLUMNS[1:])
+            self.cursor.executemany(
+                f"""
+                INSERT INTO listings_listing
+                ({', '.join(LISTING_COLUMNS)}, created_at, updated_at, last_seen_at)
+                VALUES ({placeholders(LISTING_COLUMNS)}, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE {assignments},
+                    updated_at = VALUES(updated_at), last_seen_at = VALUES(last_seen_at)
+                """,
+                [self.listing_values(listings[key]) + (now, now, now)
+                 for key in upserts]
+            )
+
+        # Listings scraped without a room id fall back to the natural key
+        updates = [key for key in listings
+                   if key in adopted or (key[0] != 'airbnb' and key in listing_ids)]
+        if updates:
+            assignments = ', '.join(
+                f"{column} = %s" for column in LISTING_COLUMNS)
+            self.cursor.executemany(
+                f"""
+                UPDATE listings_listing
+                SET {assignments}, updated_at = %s, last_seen_at = %s
+                WHERE id = %s
+                """,
+                [self.listing_values(listings[key]) + (now, now, listing_ids[key])
+                 for key in updates]
+            )
+
+        inserts = [key for key in listings if key[0] != 'airbnb' and key not in listing_ids]
+        if inserts:
+            self.cursor.executemany(
+                f"""
+                INSERT INTO listings_listing
+                ({', '.join(LISTING_COLUMNS)}, created_at, updated_at, last_seen_at)
+                VALUES ({placeholders(LISTING_COLUMNS)}, %s, %s, %s)
+                """,
+                [self.listing_values(listings[key]) + (now, now, now)
+                 for key in inserts]
+            )
+
+        new_keys = [key for key in listings if key not in listing_ids]
+        if new_keys:
+            listing_ids.update(
+                (key, listing_id)
+                for key, (listing_id, _) in self.fetch_listings(new_keys).items())
+
+        rows_by_id = {listing_ids[key]: row for key, row in listings.items()}
+        self.write_images(rows_by_id)
+        self.write_amenities(rows_by_id)
+        self.write_location_stats(*stats_deltas, now)
+        self.write_price_observations(rows_by_id, now)
+        return {key: listing_ids[key] for key in batch}, True
+
+    def write_price_observations(self, rows_by_id, now):
+        """
+        Append a price observation for each listing whose price, total or
+        rating differs from its latest one. Unchanged prices add nothing, so
+        the history is a run-length encoding of what was scraped. Rows are
+        dated by when they were scraped, so spooled items loaded later keep
+        their day; rows without a scrape time are dated now.
+        """
+        listing_ids = list(rows_by_id)
+        self.cursor.execute(
+            f"""
+            SELECT p.listing_id, p.price_per_night, p.total_price, p.rating
+            FROM listings_priceobservation p
+            JOIN (
+                SELECT listing_id, MAX(observed_on) AS observed_on
+                FROM listings_priceobservation
+                WHERE listing_id IN ({placeholders(listing_ids)})
+                GROUP BY listing_id
+            ) latest ON latest.listing_id = p.listing_id
+                    AND latest.observed_on = p.observed_on
+            """,
+            listing_ids
+        )
+        latest = {listing_id: (to_cents(price), to_cents(total), to_cents(rating))
+                  for listing_id, price, total, rating in self.cursor.fetchall()}
+
+        observations = []
+        for listing_id, row in sorted(rows_by_id.items()):
+            values = (to_cents(row['price_per_night']), to_cents(row['total_price']),
+                      to_cents(row['rating']))
+            if latest.get(listing_id) != values:
+                observed_on = (row.get('scraped_at') or now).date()
+                observations.append((listing_id, observed_on, *values, row['currency']))
+
+        if observations:
+            # A second change on the same day replaces that day's observation
+            self.cursor.executemany(
+                """
+                INSERT INTO listings_priceobservation
+                (listing_id, observed_on, price_per_night, total_price, rating, currency)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE price_per_night = VALUES(price_per_night),
+                    total_price = VALUES(total_price), rating = VALUES(rating),
+                    currency = VALUES(currency)
+                """,
+                observations
+            )
+        self.stats['mysql/price_observations'] += len(observations)
+
+    def lock_stats_state(self, listing_ids, airbnb_ids):
+        """
+        (id, airbnb_id, state) of the stored listings with these ids or room
+        ids, state being what the listing contributes to its location's
+        rollup. The rows stay locked for the rest of the transaction. The superhost
+        flag is read after the host upsert, so a host changing status only
+        reaches the rollups on a full rebuild.
+        """
+        conditions, params = [], []
+        if listing_ids:
+            conditions.append(f"l.id IN ({placeholders(listing_ids)})")
+            params += listing_ids
+        if airbnb_ids:
+            conditions.append(f"l.airbnb_id IN ({placeholders(airbnb_ids)})")
+            params += airbnb_ids
+        if not conditions:
+            return []
+        self.cursor.execute(
+            f"""
+            SELECT l.id, l.airbnb_id, l.location, l.price_per_night, l.rating,
+                   h.is_superhost
+            FROM listings_listing l JOIN listings_host h ON h.id = l.host_id
+            WHERE {' OR '.join(conditions)}
+            ORDER BY l.id
+            FOR UPDATE OF l
+            """,
+            params
+        )
+        return [(listing_id, airbnb_id, (location, price, rating, bool(superhost)))
+                for listing_id, airbnb_id, location, price, rating, superhost
+                in self.cursor.fetchall()]
+
+    def location_stats_deltas(self, changes):
+        """
+        Per-location changes to the rollup sums and price buckets for
+        (stored state or None, new row) pairs.
+        """
+        totals = defaultdict(lambda: [0, Decimal(0), 0, Decimal(0), 0])
+        buckets = Counter()
+
+        def apply(location, price, rating, superhost, sign):
+            entry = totals[location]
+            entry[0] += sign
+            entry[1] += sign * Decimal(str(price))
+            if rating is not None:
+                entry[2] += sign
+                entry[3] += sign * Decimal(str(rating))
+            entry[4] += sign * bool(superhost)
+            buckets[(location, price_bucket(price))] += sign
+
+        for old, row in changes:
+            if old is not None:
+                apply(*old, sign=-1)
+            apply(row['location'], row['price_per_night'], row['rating'],
+                  row['host_is_superhost'], sign=1)
+
+        totals = {location: entry for location, entry in totals.items() if any(entry)}
+        buckets = {key: count for key, count in buckets.items() if count}
+        return totals, buckets
+
+    def write_location_stats(self, totals, buckets, now):
+        if not totals and not buckets:
+            return
+
+        # Additive upserts, so concurrent writers never lose each other's
+        # changes; the percentiles are then re-derived from the buckets.
+        # Every writer touches these shared rows in the same sorted order, so
+        # concurrent batches queue on them instead of deadlocking.
+        if totals:
+            self.cursor.executemany(
+                """
+                INSERT INTO listings_locationstats
+                (location, listing_count, price_total, rated_count, rating_total,
+                 superhost_count, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    listing_count = listing_count + VALUES(listing_count),
+                    price_total = price_total + VALUES(price_total),
+                    rated_count = rated_count + VALUES(rated_count),
+                    rating_total = rating_total + VALUES(rating_total),
+                    superhost_count = superhost_count + VALUES(superhost_count),
+                    updated_at = VALUES(updated_at)
+                """,
+                [(location, *entry, now) for location, entry in sorted(totals.items())]
+            )
+        if buckets:
+            self.cursor.executemany(
+                """
+                INSERT INTO listings_locationpricebucket (location, bucket, listing_count)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE listing_count = listing_count + VALUES(listing_count)
+                """,
+                [(location, bucket, count)
+                 for (location, bucket), count in sorted(buckets.items())]
+            )
+
+        locations = sorted({location for location, _ in buckets})
+        if locations:
+            self.cursor.execute(
+                f"""
+                SELECT location, bucket, listing_count FROM listings_locationpricebucket
+                WHERE location IN ({placeholders(locations)}) AND listing_count > 0
+                ORDER BY location, bucket
+                """,
+                locations
+            )
+            histograms = defaultdict(list)
+            for location, bucket, count in self.cursor.fetchall():
+                histograms[location].append((bucket, count))
+            self.cursor.executemany(
+                """
+                UPDATE listings_locationstats SET median_price = %s, p90_price = %s
+                WHERE location = %s
+                """,
+                [(bucket_percentile(histograms[location], 0.5),
+                  bucket_percentile(histograms[location], 0.9), location)
+                 for location in locations]
+            )
+
+        self.stats['mysql/location_stats_updated'] += len(set(totals) | set(locations))
+
+    def write_availability(self, rows, listing_ids, now):
+        """
+        Mark the nights each listing was found available for and raise its
+        guest count to the search's. Nights are only ever added here, and
+        observed_days tracks the ones the latest crawl found; what a crawl
+        searched without finding is dropped once it finishes. Rows from a
+        crawl older than the stored one are ignored. Returns whether
+        anything changed.
+        """
+        wanted = {}
+        guests = {}
+        for row in rows:
+            listing_id = listing_ids[listing_key(row)]
+            observed_at = row.get('crawl_started') or now
+            for month, mask in night_masks(row['check_in'], row['check_out']).items():
+                seen_at, days = wanted.get((listing_id, month), (observed_at, 0))
+                if observed_at > seen_at:
+                    wanted[(listing_id, month)] = (observed_at, mask)
+                elif observed_at == seen_at:
+                    wanted[(listing_id, month)] = (seen_at, days | mask)
+            if row['guests']:
+                guests[listing_id] = max(guests.get(listing_id, 0), row['guests'])
+
+        changes = []
+        if wanted:
+            listing_ids = list({listing_id for listing_id, _ in wanted})
+            months = list({month for _, month in wanted})
+            self.cursor.execute(
+                f"""
+                SELECT listing_id, month, days, observed_days, observed_at
+                FROM listings_listingavailability
+                WHERE listing_id IN ({placeholders(listing_ids)})
+                  AND month IN ({placeholders(months)})
+                """,
+                listing_ids + months
+            )
+            current = {(listing_id, month): (days, observed_days, observed_at)
+                       for listing_id, month, days, observed_days, observed_at
+                       in self.cursor.fetchall()}
+            for key, (observed_at, mask) in sorted(wanted.items()):
+                days, observed_days, seen_at = current.get(key, (None, 0, None))
+                if (days is None or seen_at is None or observed_at > seen_at
+                        or (observed_at == seen_at
+                            and (days | mask != days
+                                 or observed_days | mask != observed_days))):
+                    changes.append((*key, mask, mask, observed_at, now))
+        if changes:
+            # Decided again in the upsert, so concurrent writers cannot drop
+            # nights and an older crawl never wins. MySQL assigns left to
+            # right, so observed_at has to come after the columns reading it.
+            self.cursor.executemany(
+                """
+                INSERT INTO listings_listingavailability
+                    (listing_id, month, days, observed_days, observed_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    days = CASE
+                        WHEN observed_at IS NULL OR VALUES(observed_at) >= observed_at
+                            THEN days | VALUES(days)
+                        ELSE days END,
+                    observed_days = CASE
+                        WHEN observed_at IS NULL OR VALUES(observed_at) > observed_at
+                            THEN VALUES(observed_days)
+                        WHEN VALUES(observed_at) = observed_at
+                            THEN observed_days | VALUES(observed_days)
+                        ELSE observed_days END,
+                    observed_at = CASE
+                        WHEN observed_at IS NULL OR VALUES(observed_at) > observed_at
+                            THEN VALUES(observed_at)
+                        ELSE observed_at END,
+                    updated_at = VALUES(updated_at)
+                """,
+                changes
+            )
+        self.stats['mysql/availability_rows_written'] += len(changes)
+
+        raised = 0
+        if guests:
+            self.cursor.executemany(
+                """
+                UPDATE listings_listing SET max_guests = %s
+                WHERE id = %s AND (max_guests IS NULL OR max_guests < %s)
+                """,
+                [(count, listing_id, count) for listing_id, count in sorted(guests.items())]
+            )
+            raised = max(self.cursor.rowcount, 0)
+        self.stats['mysql/max_guests_raised'] += raised
+
+        return bool(changes or raised)
+
+    def bump_data_version(self, now):
+        # Listing API caches are keyed on this counter, so every batch that
+        # changes listings invalidates them once it commits
+        self.cursor.execute(
+            """
+            INSERT INTO listings_dataversion (id, version, updated_at)
+            VALUES (1, 1, %s)
+            ON DUPLICATE KEY UPDATE version = version + 1, updated_at = VALUES(updated_at)
+            """,
+            (now,)
+        )
+
+    def listing_values(self, row):
+        return tuple(row[column] for column in LISTING_COLUMNS)
+
+    def adopt_hosts(self, hosts):
+        # Hosts stored before their Airbnb user id was scraped are matched by
+        # name once and then tagged with the id
+        names = {row['host_name']: key for key, row in hosts.items()
+                 if key[0] == 'airbnb'}
+        if not names:
+            return {}
+
+        self.cursor.execute(
+            f"SELECT name, MIN(id) FROM listings_host "
+            f"WHERE airbnb_id IS NULL AND name IN ({placeholders(names)}) "
+            f"GROUP BY name",
+            list(names)
+        )
+        adopted = {names[name]: host_id for name, host_id in self.cursor.fetchall()}
+        if adopted:
+            self.cursor.executemany(
+                "UPDATE listings_host SET airbnb_id = %s WHERE id = %s",
+                [(key[1], host_id) for key, host_id in adopted.items()]
+            )
+        return adopted
+
+    def insert_hosts(self, rows):
+        self.cursor.executemany(
+            """
+            INSERT INTO listings_host
+            (airbnb_id, name, image_url, is_superhost, joined_date)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE name = VALUES(name)
+            """,
+            [(row['host_airbnb_id'], row['host_name'], row['host_image'],
+              row['host_is_superhost'], row['host_joined']) for row in rows]
+        )
+
+    def cached_ids(self, cache, name, keys, fetch):
+        ids = {}
+        missing = []
+        for key in keys:
+            value = cache.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                ids[key] = value
+
+        self.stats[f'mysql/cache/{name}_hits'] += len(ids)
+        self.stats[f'mysql/cache/{name}_misses'] += len(missing)
+
+        if missing:
+            ids.update(self.cache_ids(cache, fetch(missing)))
+        return ids
+
+    def cache_ids(self, cache, ids):
+        # Caches are shared with other writers, so ids only become visible
+        # there once this batch has committed
+        self.discovered.extend((cache, key, value) for key, value in ids.items())
+        return ids
+
+    def fetch_host_ids(self, keys):
+        ids = {}
+        airbnb_ids = [key[1] for key in keys if key[0] == 'airbnb']
+        if airbnb_ids:
+            self.cursor.execute(
+                f"SELECT airbnb_id, id FROM listings_host "
+                f"WHERE airbnb_id IN ({placeholders(airbnb_ids)})",
+                airbnb_ids
+            )
+            ids.update((('airbnb', airbnb_id), host_id)
+                       for airbnb_id, host_id in self.cursor.fetchall())
+
+        names = [key[1] for key in keys if key[0] == 'name']
+        if names:
+            self.cursor.execute(
+                f"SELECT name, id FROM listings_host WHERE name IN ({placeholders(names)})",
+                names
+            )
+            ids.update((('name', name), host_id)
+                       for name, host_id in self.cursor.fetchall())
+        return ids
+
+    def fetch_listings(self, keys, unclaimed_only=False):
+        found = {}
+        airbnb_ids = [key[1] for key in keys if key[0] == 'airbnb']
+        if airbnb_ids:
+            self.cursor.execute(
+                f"SELECT airbnb_id, id, content_hash FROM listings_listing "
+                f"WHERE airbnb_id IN ({placeholders(airbnb_ids)})",
+                airbnb_ids
+            )
+            found.update((('airbnb', airbnb_id), (listing_id, fingerprint))
+                         for airbnb_id, listing_id, fingerprint in self.cursor.fetchall())
+
+        natural = [key for key in keys if key[0] == 'natural']
+        if natural:
+            titles = list({key[1] for key in natural})
+            host_ids = list({key[3] for key in natural})
+            self.cursor.execute(
+                f"""
+                SELECT title, location, host_id, id, content_hash FROM listings_listing
+                WHERE title IN ({placeholders(titles)})
+                  AND host_id IN ({placeholders(host_ids)})
+                  {'AND airbnb_id IS NULL' if unclaimed_only else ''}
+                """,
+                titles + host_ids
+            )
+            wanted = set(natural)
+            for title, location, host_id, listing_id, fingerprint in self.cursor.fetchall():
+                key = ('natural', title, location, host_id)
+                if key in wanted:
+                    found[key] = (listing_id, fingerprint)
+        return found
+
+    def write_images(self, rows_by_id):
+        images = {}
+        for listing_id, row in rows_by_id.items():
+            for i, image_url in enumerate(dict.fromkeys(row['image_urls'])):
+                images[(listing_id, image_url, i == 0)] = None
+
+        self.sync_child_rows(
+            'listings_listingimage', ('listing_id', 'image_url', 'is_primary'),
+            list(rows_by_id), images)
+
+    def resolve_amenities(self, rows):
+        """Set amenity_ids and amenity_bits on each row, adding new amenities."""
+        rows = list(rows)
+        names = list({name for row in rows for name in row['amenities']})
+        amenity_ids = {}
+
+        if names:
+            # Insert amenities we have not seen before
+            amenity_ids = self.cached_ids(
+                self.amenity_ids, 'amenity', names, self.fetch_amenity_ids)
+            new_names = [name for name in names if name not in amenity_ids]
+            if new_names:
+                self.cursor.executemany(
+                    """
+                    INSERT INTO listings_amenity (name) VALUES (%s)
+                    ON DUPLICATE KEY UPDATE name = VALUES(name)
+                    """,
+                    [(name,) for name in new_names]
+                )
+                amenity_ids.update(self.cache_ids(
+                    self.amenity_ids, self.fetch_amenity_ids(new_names)))
+
+        for row in rows:
+            row['amenity_ids'] = list(dict.fromkeys(
+                amenity_ids[name] for name in row['amenities']))
+            row['amenity_bits'] = amenity_bits(row['amenity_ids'])
+
+    def write_amenities(self, rows_by_id):
+        # Link amenities to listings
+        links = {}
+        for listing_id, row in rows_by_id.items():
+            for amenity_id in row['amenity_ids']:
+                links[(listing_id, amenity_id)] = None
+
+        self.sync_child_rows(
+            'listings_listingamenity', ('listing_id', 'amenity_id'),
+            list(rows_by_id), links)
+
+    def sync_child_rows(self, table, columns, listing_ids, wanted):
+        """
+        Make the rows of `table` for `listing_ids` match `wanted`, an ordered
+        set of column tuples, with only the deletes and inserts required
+        """
+        self.cursor.execute(
+            f"SELECT id, {', '.join(columns)} FROM {table} "
+            f"WHERE listing_id IN ({placeholders(listing_ids)})",
+            listing_ids
+        )
+        kept = set()
+        stale_ids = []
+        for row_id, *values in self.cursor.fetchall():
+            values = tuple(values)
+            if values in wanted and values not in kept:
+                kept.add(values)
+            else:
+                stale_ids.append(row_id)
+
+        if stale_ids:
+            self.cursor.execute(
+                f"DELETE FROM {table} WHERE id IN ({placeholders(stale_ids)})",
+                stale_ids
+            )
+
+        missing = [values for values in wanted if values not in kept]
+        if missing:
+            self.cursor.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({placeholders(columns)})",
+                missing
+            )
+
+        self.stats['mysql/child_rows_inserted'] += len(missing)
+        self.stats['mysql/child_rows_deleted'] += len(stale_ids)
+        self.stats['mysql/child_rows_skipped'] += len(kept)
+
+    def fetch_amenity_ids(self, names):
+        self.cursor.execute(
+            f"SELECT name, id FROM listings_amenity WHERE name IN ({placeholders(names)})",
+            names
+        )
+        return dict(self.cursor.fetchall())
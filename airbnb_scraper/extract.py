@@ -0,0 +1,267 @@
+import base64
+import binascii
+import json
+import re
+from datetime import datetime
+
+from parsel.csstranslator import css2xpath
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Embedded JSON blobs on search pages that carry the result cards
+SEARCH_RESULTS_MARKER = '"searchResults"'
+# ...and on listing pages the one holding `data.presentation`
+PRESENTATION_MARKER = '"presentation"'
+
+# Selectors are translated to XPath once here rather than on every page
+JSON_SCRIPTS = css2xpath('script[type="application/json"]::text')
+TITLE = css2xpath('h1::text')
+LOCATION = css2xpath('span[data-testid="listing-location"]::text')
+ADDRESS = css2xpath('div[data-testid="listing-address"]::text')
+PRICE = css2xpath('span[data-testid="listing-price"] span::text')
+TOTAL_PRICE = css2xpath('span[data-testid="listing-total-price"]::text')
+RATING = css2xpath('span[data-testid="listing-rating"]::text')
+REVIEWS_COUNT = css2xpath('span[data-testid="listing-reviews-count"]::text')
+DESCRIPTION = css2xpath('div[data-testid="listing-description"]::text')
+PROPERTY_TYPE = css2xpath('div[data-testid="listing-property-type"]::text')
+IMAGES = css2xpath('img[data-testid="listing-image"]::attr(src)')
+AMENITIES = css2xpath('div[data-testid="listing-amenities"] div::text')
+HOST_SECTION = css2xpath('div[data-testid="host-profile"]')
+HOST_NAME = css2xpath('h2::text')
+HOST_IMAGE = css2xpath('img::attr(src)')
+HOST_LINK = css2xpath('a::attr(href)')
+SUPERHOST_BADGE = css2xpath('div[data-testid="superhost-badge"]')
+HOST_JOINED = css2xpath('div[data-testid="host-joined-date"]::text')
+# Older page layout
+FALLBACK_LOCATION = css2xpath('._9xiloll ::text')
+FALLBACK_PRICE = css2xpath('._tyxjp1 ::text')
+FALLBACK_IMAGES = css2xpath('._6tbg2q img::attr(src)')
+
+ROOM_ID_RE = re.compile(r'/rooms/(?:plus/)?(\d+)')
+HOST_ID_RE = re.compile(r'/users/(?:show|profile)/(\d+)')
+CURRENCY_PRICE_RE = re.compile(r'([$€£])(\d+)')
+DIGITS_RE = re.compile(r'(\d+)')
+JOINED_RE = re.compile(r'Joined in (\w+ \d{4})')
+
+PRICE_RE = re.compile(r'([$€£])\s*([\d,]+(?:\.\d+)?)')
+NIGHTS_RE = re.compile(r'for (\d+) nights?')
+RATING_RE = re.compile(r'(\d+(?:\.\d+)?)\s*\((\d[\d,]*)\)')
+TRAILING_ID_RE = re.compile(r'(\d+)$')
+
+
+def loads(text):
+    """json.loads, through orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def json_payloads(response, marker):
+    """
+    Decoded JSON script blobs of a page that contain `marker`; the others
+    are skipped without being decoded.
+    """
+    for script in response.xpath(JSON_SCRIPTS).getall():
+        if marker not in script:
+            continue
+        try:
+            yield loads(script)
+        except ValueError:
+            # orjson.JSONDecodeError is a ValueError too
+            continue
+
+
+def search_payloads(response):
+    """Decoded JSON script blobs of a search page that hold search results."""
+    return json_payloads(response, SEARCH_RESULTS_MARKER)
+
+
+def iter_search_results(data):
+    """Every entry of every `searchResults` list nested anywhere in `data`."""
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            results = node.get('searchResults')
+            if isinstance(results, list):
+                yield from (result for result in results if isinstance(result, dict))
+            stack.extend(value for key, value in node.items()
+                         if key != 'searchResults' and isinstance(value, (dict, list)))
+        elif isinstance(node, list):
+            stack.extend(value for value in node if isinstance(value, (dict, list)))
+
+
+def room_id(value):
+    """
+    Numeric room id from a search result id, which is either the number
+    itself or base64 of 'DemandStayListing:<number>'.
+    """
+    if value is None:
+        return None
+    value = str(value)
+    if value.isdigit():
+        return value
+    try:
+        value = base64.b64decode(value, validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    match = TRAILING_ID_RE.search(value)
+    return match.group(1) if match else None
+
+
+def parse_number(text):
+    return float(text.replace(',', ''))
+
+
+def search_result_fields(result):
+    """
+    Listing fields carried by one search result card, or None when it is
+    not a listing. Only keys the card actually has are filled in.
+    """
+    listing = result.get('listing') or {}
+    demand = result.get('demandStayListing') or {}
+    airbnb_id = room_id(listing.get('id') or demand.get('id'))
+    if not airbnb_id:
+        return None
+
+    fields = {'airbnb_id': airbnb_id}
+    title = listing.get('name') or result.get('name') or listing.get('title')
+    if title:
+        fields['title'] = title.strip()
+
+    pictures = result.get('contextualPictures') or listing.get('contextualPictures') or []
+    if pictures and isinstance(pictures[0], dict) and pictures[0].get('picture'):
+        fields['image_urls'] = [pictures[0]['picture']]
+
+    rating = result.get('avgRatingLocalized') or listing.get('avgRatingLocalized')
+    match = RATING_RE.search(rating or '')
+    if match:
+        fields['rating'] = float(match.group(1))
+        fields['reviews_count'] = int(parse_number(match.group(2)))
+
+    price_line = (((result.get('pricingQuote') or {})
+                   .get('structuredStayDisplayPrice') or {})
+                  .get('primaryLine') or {})
+    price_text = price_line.get('discountedPrice') or price_line.get('price')
+    match = PRICE_RE.search(price_text or '')
+    if match:
+        amount = parse_number(match.group(2))
+        fields['currency'] = match.group(1)
+        nights = NIGHTS_RE.search(price_line.get('qualifier') or '')
+        if nights and int(nights.group(1)) > 0:
+            fields['total_price'] = amount
+            fields['price_per_night'] = round(amount / int(nights.group(1)), 2)
+        else:
+            fields['price_per_night'] = amount
+
+    return fields
+
+
+def extract_text(text):
+    if not text:
+        return None
+    return text.strip()
+
+
+def extract_price(text):
+    if not text:
+        return None
+    price_match = DIGITS_RE.search(text.replace(',', ''))
+    return float(price_match.group(1)) if price_match else None
+
+
+def all_text(selector, xpath):
+    """Stripped, non-empty text nodes under `xpath` joined by a space."""
+    parts = [part.strip() for part in selector.xpath(xpath).getall()]
+    return ' '.join(part for part in parts if part) or None
+
+
+def presentation_data(response):
+    """The `data.presentation` object of a listing page, or None."""
+    for data in json_payloads(response, PRESENTATION_MARKER):
+        inner = data.get('data') if isinstance(data, dict) else None
+        if isinstance(inner, dict) and 'presentation' in inner:
+            return inner['presentation']
+    return None
+
+
+def host_joined(text):
+    joined_match = JOINED_RE.search(text or '')
+    if not joined_match:
+        return None
+    try:
+        return datetime.strptime(joined_match.group(1), '%B %Y').strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def listing_fields(response):
+    """
+    Listing fields of a listing detail page. The rendered markup is read
+    when the page carries its presentation data; the older layout's
+    selectors fill in whatever is still missing.
+    """
+    room_match = ROOM_ID_RE.search(response.url)
+    fields = {'airbnb_id': room_match.group(1) if room_match else None}
+
+    if presentation_data(response) is not None:
+        fields['title'] = extract_text(response.xpath(TITLE).get())
+        fields['location'] = extract_text(response.xpath(LOCATION).get())
+        fields['address'] = extract_text(response.xpath(ADDRESS).get())
+
+        price_text = response.xpath(PRICE).get()
+        if price_text:
+            price_match = CURRENCY_PRICE_RE.search(price_text)
+            if price_match:
+                fields['currency'] = price_match.group(1)
+                fields['price_per_night'] = float(price_match.group(2))
+            else:
+                fields['currency'] = '$'
+                fields['price_per_night'] = extract_price(price_text)
+
+        fields['total_price'] = extract_price(response.xpath(TOTAL_PRICE).get())
+
+        rating_text = extract_text(response.xpath(RATING).get())
+        try:
+            fields['rating'] = float(rating_text) if rating_text else None
+        except ValueError:
+            fields['rating'] = None
+
+        reviews_text = response.xpath(REVIEWS_COUNT).get()
+        if reviews_text:
+            reviews_match = DIGITS_RE.search(reviews_text)
+            fields['reviews_count'] = int(reviews_match.group(1)) if reviews_match else 0
+
+        fields['description'] = extract_text(response.xpath(DESCRIPTION).get())
+        fields['property_type'] = extract_text(response.xpath(PROPERTY_TYPE).get())
+        fields['image_urls'] = response.xpath(IMAGES).getall()
+        fields['amenities'] = [amenity for amenity in
+                               map(extract_text, response.xpath(AMENITIES).getall())
+                               if amenity]
+
+        host_section = response.xpath(HOST_SECTION)
+        fields['host_name'] = extract_text(host_section.xpath(HOST_NAME).get())
+        fields['host_image'] = host_section.xpath(HOST_IMAGE).get()
+        fields['host_airbnb_id'] = host_section.xpath(HOST_LINK).re_first(HOST_ID_RE)
+        fields['host_is_superhost'] = bool(host_section.xpath(SUPERHOST_BADGE))
+        joined_text = host_section.xpath(HOST_JOINED).get()
+        if joined_text:
+            fields['host_joined'] = host_joined(joined_text)
+
+    if not fields.get('title'):
+        fields['title'] = extract_text(response.xpath(TITLE).get())
+
+    if not fields.get('location'):
+        fields['location'] = all_text(response, FALLBACK_LOCATION)
+
+    if not fields.get('price_per_night'):
+        fields['price_per_night'] = extract_price(all_text(response, FALLBACK_PRICE))
+        fields['currency'] = '$'  # Default currency
+
+    if not fields.get('image_urls'):
+        fields['image_urls'] = response.xpath(FALLBACK_IMAGES).getall()
+
+    return fields
@@ -3,6 +3,7 @@ import scrapy
 
 class AirbnbListingItem(scrapy.Item):
     # Listing details
+    airbnb_id = scrapy.Field()
     title = scrapy.Field()
     location = scrapy.Field()
     address = scrapy.Field()
@@ -16,7 +17,22 @@ class AirbnbListingItem(scrapy.Item):
     amenities = scrapy.Field()
     property_type = scrapy.Field()
 
+    # Search the listing was found by: available for these nights and guests
+    check_in = scrapy.Field()
+    check_out = scrapy.Field()
+    guests = scrapy.Field()
+    # When the crawl (or sharded run) that found it started; availability
+    # rows remember it, and ignore items of older crawls
+    crawl_started = scrapy.Field()
+    # When the page was parsed, as ISO UTC; dates the price observation
+    scraped_at = scrapy.Field()
+
+    # Built from a search result card alone: only the airbnb_id, price,
+    # rating and review count are meant to be written
+    partial = scrapy.Field()
+
     # Host details
+    host_airbnb_id = scrapy.Field()
     host_name = scrapy.Field()
     host_image = scrapy.Field()
     host_is_superhost = scrapy.Field()
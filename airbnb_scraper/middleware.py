@@ -1,6 +1,16 @@
 import random
-from scrapy import signals
+import sqlite3
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from scrapy import Request, signals
 from scrapy.downloadermiddlewares.useragent import UserAgentMiddleware
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+
+from .extract import ROOM_ID_RE
+
+# Listing URL query params that change the quoted price; everything else on
+# card links (search ids, impression and section tracking) is dropped
+PRICING_PARAMS = ('check_in', 'check_out', 'adults', 'children', 'infants', 'pets')
+PRICING_PARAM_ALIASES = {'checkin': 'check_in', 'checkout': 'check_out'}
 
 
 class RandomUserAgentMiddleware(UserAgentMiddleware):
@@ -16,3 +26,132 @@ class RandomUserAgentMiddleware(UserAgentMiddleware):
     def process_request(self, request, spider):
         user_agent = random.choice(self.user_agent_list)
         request.headers['User-Agent'] = user_agent
+
+
+class ListingDedupeMiddleware:
+    """
+    Drops listing requests that another crawl sharing the same SQLite file
+    already claimed for the same stay, so shards of a sharded run covering
+    overlapping markets fetch each listing once. A listing is claimed per
+    room id, dates and guests: the same room is still fetched for every
+    date window. A claim whose fetch finally fails is released, so another
+    shard or a later run can still fetch the listing.
+    """
+
+    def __init__(self, path, stats):
+        self.stats = stats
+        # Autocommit; the timeout covers other processes holding the write lock
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS claimed_listings (key TEXT PRIMARY KEY)')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('LISTING_DEDUPE_DB')
+        if not path:
+            raise NotConfigured('LISTING_DEDUPE_DB is not set')
+        middleware = cls(path, crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider):
+        room_match = ROOM_ID_RE.search(request.url)
+        if not room_match or request.meta.get('dedupe_claimed'):
+            return None
+
+        key = ':'.join(str(part) for part in (
+            room_match.group(1), getattr(spider, 'check_in', ''),
+            getattr(spider, 'check_out', ''), getattr(spider, 'guests', '')))
+        cursor = self.conn.execute(
+            'INSERT OR IGNORE INTO claimed_listings (key) VALUES (?)', (key,))
+        if cursor.rowcount == 0:
+            self.stats.inc_value('dedupe/listings_skipped')
+            raise IgnoreRequest(f'Listing already claimed by another shard: {key}')
+
+        # Retries and redirects of a claimed request come through here again
+        request.meta['dedupe_claimed'] = key
+        self.stats.inc_value('dedupe/listings_claimed')
+        return None
+
+    def process_response(self, request, response, spider):
+        # Retried and redirected responses never get this far
+        if response.status != 200:
+            self.release(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        # Also called for the IgnoreRequest raised above, before any claim
+        self.release(request)
+        return None
+
+    def release(self, request):
+        key = request.meta.pop('dedupe_claimed', None)
+        if key:
+            self.conn.execute('DELETE FROM claimed_listings WHERE key = ?', (key,))
+            self.stats.inc_value('dedupe/claims_released')
+
+    def spider_closed(self, spider):
+        self.conn.close()
+
+
+def canonical_listing_url(url, defaults=None):
+    """
+    `url` reduced to https://www.airbnb.com/rooms/<id> plus, sorted, the
+    query params that change the quoted price; None when it is not a
+    listing URL. `defaults` fills pricing params the URL lacks.
+    """
+    room_match = ROOM_ID_RE.search(urlsplit(url).path)
+    if not room_match:
+        return None
+
+    params = dict(defaults or {})
+    for name, value in parse_qsl(urlsplit(url).query):
+        name = PRICING_PARAM_ALIASES.get(name, name)
+        if name in PRICING_PARAMS and value:
+            params[name] = value
+    query = urlencode(sorted((name, str(value)) for name, value in params.items() if value))
+    return f"https://www.airbnb.com/rooms/{room_match.group(1)}" + (f'?{query}' if query else '')
+
+
+class CanonicalListingUrlMiddleware:
+    """
+    Rewrites the listing requests a spider yields to their canonical URL, so
+    the same room reached from different searches or pages, with its
+    tracking params, fingerprints the same for the dupefilter and the HTTP
+    cache. Missing dates and adults come from the spider's own search.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.seen_urls = set()
+        self.seen_canonical = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        defaults = {'check_in': getattr(spider, 'check_in', None),
+                    'check_out': getattr(spider, 'check_out', None),
+                    'adults': getattr(spider, 'guests', None)}
+        for request in result:
+            if isinstance(request, Request):
+                request = self.canonicalize(request, defaults)
+            yield request
+
+    def canonicalize(self, request, defaults):
+        canonical = canonical_listing_url(request.url, defaults)
+        if canonical is None:
+            return request
+
+        if canonical in self.seen_canonical and request.url not in self.seen_urls:
+            # Would have been fetched again under a different URL
+            self.stats.inc_value('canonical/duplicates_avoided')
+        self.seen_urls.add(request.url)
+        self.seen_canonical.add(canonical)
+
+        if canonical == request.url:
+            return request
+        self.stats.inc_value('canonical/listing_urls_rewritten')
+        return request.replace(url=canonical)
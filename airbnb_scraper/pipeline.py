@@ -1,177 +1,269 @@
+import logging
+import time
+
 import mysql.connector
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+from scrapy.utils.log import failure_to_exc_info
+from scrapy.utils.misc import load_object
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
+
+from .db import (REQUIRED_FIELDS, ConnectionPool, LRUCache, item_row,
+                 preload_caches, write_transaction)
+from .spool import SpoolWriter
+
+logger = logging.getLogger(__name__)
+
+
+def check_required_fields(adapter):
+    """Drop an item that could not be written to the listings tables."""
+    # Search-card items only update listings that are already stored
+    required = ('airbnb_id',) if adapter.get('partial') else REQUIRED_FIELDS
+    missing = [field for field in required if not adapter.get(field)]
+    if missing:
+        raise DropItem(f"Missing required fields: {', '.join(missing)}")
 
 
 class MySQLPipeline:
-    def __init__(self, mysql_host, mysql_port, mysql_user, mysql_password, mysql_db):
+    def __init__(self, mysql_host, mysql_port, mysql_user, mysql_password, mysql_db,
+                 buffer_size=1, buffer_max_age=0, host_cache_size=10000,
+                 amenity_cache_size=2000, writer_threads=0, max_pending_writes=4,
+                 transaction_retries=3, connection_factory=None, stats=None):
         self.mysql_host = mysql_host
         self.mysql_port = mysql_port
         self.mysql_user = mysql_user
         self.mysql_password = mysql_password
         self.mysql_db = mysql_db
-        self.conn = None
-        self.cursor = None
+        self.connection_factory = connection_factory or self.connect
+        self.pool = None
+
+        # Buffered write mode: items are collected in memory and written in
+        # one transaction once `buffer_size` items are pending or the oldest
+        # pending item is `buffer_max_age` seconds old.
+        self.buffer_size = max(buffer_size or 1, 1)
+        self.buffer_max_age = buffer_max_age
+        self.buffer = []
+        self.buffer_started = None
+        self.flush_timer = None
+        self.stats = stats
+
+        # Threaded write mode: batches are written by `writer_threads` threads,
+        # each holding one pooled connection, so the reactor never blocks on
+        # MySQL. Once `max_pending_writes` batches are queued or in flight,
+        # further items wait, which holds the scraper back.
+        self.writer_threads = writer_threads
+        self.threadpool = None
+        self.pending_writes = defer.DeferredSemaphore(max(max_pending_writes, 1))
+        self.in_flight = set()
+        # Concurrent batches can deadlock on shared rows; the loser is retried
+        self.transaction_retries = transaction_retries
+
+        # Host and amenity ids are looked up for every item; keep the hot
+        # ones in process so most lookups never reach the database.
+        self.host_ids = LRUCache(host_cache_size)
+        self.amenity_ids = LRUCache(amenity_cache_size)
 
     @classmethod
     def from_crawler(cls, crawler):
+        connection_factory = crawler.settings.get('MYSQL_CONNECTION_FACTORY')
         return cls(
             mysql_host=crawler.settings.get('MYSQL_HOST'),
             mysql_port=crawler.settings.get('MYSQL_PORT'),
             mysql_user=crawler.settings.get('MYSQL_USER'),
             mysql_password=crawler.settings.get('MYSQL_PASSWORD'),
-            mysql_db=crawler.settings.get('MYSQL_DB')
+            mysql_db=crawler.settings.get('MYSQL_DB'),
+            buffer_size=crawler.settings.getint('MYSQL_BUFFER_SIZE', 1),
+            buffer_max_age=crawler.settings.getfloat(
+                'MYSQL_BUFFER_MAX_AGE', 0),
+            host_cache_size=crawler.settings.getint(
+                'MYSQL_HOST_CACHE_SIZE', 10000),
+            amenity_cache_size=crawler.settings.getint(
+                'MYSQL_AMENITY_CACHE_SIZE', 2000),
+            writer_threads=crawler.settings.getint('MYSQL_WRITER_THREADS', 0),
+            max_pending_writes=crawler.settings.getint(
+                'MYSQL_MAX_PENDING_WRITES', 4),
+            transaction_retries=crawler.settings.getint(
+                'MYSQL_TRANSACTION_RETRIES', 3),
+            connection_factory=load_object(
+                connection_factory) if connection_factory else None,
+            stats=crawler.stats
         )
 
-    def open_spider(self, spider):
-        self.conn = mysql.connector.connect(
+    def connect(self):
+        return mysql.connector.connect(
             host=self.mysql_host,
             port=self.mysql_port,
             user=self.mysql_user,
             password=self.mysql_password,
             database=self.mysql_db
         )
-        self.cursor = self.conn.cursor()
+
+    def open_spider(self, spider):
+        self.pool = ConnectionPool(
+            self.connection_factory, max(self.writer_threads, 1))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                preload_caches(cursor, self.host_ids, self.amenity_ids)
+            finally:
+                cursor.close()
+
+        if self.stats:
+            self.stats.set_value('mysql/cache/host_preloaded', len(self.host_ids))
+            self.stats.set_value(
+                'mysql/cache/amenity_preloaded', len(self.amenity_ids))
+
+        if self.writer_threads:
+            # ThreadPool starts 5 threads by default, more than it allows
+            # when fewer writer threads are configured
+            self.threadpool = ThreadPool(
+                minthreads=self.writer_threads, maxthreads=self.writer_threads,
+                name='MySQLPipeline')
+            self.threadpool.start()
+
+        # Flush aged buffers even when no new items arrive to trigger it
+        if self.buffer_size > 1 and self.buffer_max_age > 0:
+            self.flush_timer = task.LoopingCall(self.flush_on_timer)
+            self.flush_timer.start(self.buffer_max_age, now=False)
 
     def close_spider(self, spider):
-        self.cursor.close()
-        self.conn.close()
+        if self.flush_timer and self.flush_timer.running:
+            self.flush_timer.stop()
+
+        if not self.threadpool:
+            try:
+                self.flush_logged()
+            finally:
+                self.pool.close()
+            return None
+
+        # Drain everything still queued for the writer threads
+        self.flush_logged()
+        d = defer.DeferredList(list(self.in_flight), consumeErrors=True)
+        d.addBoth(lambda _: self.shutdown())
+        return d
+
+    def shutdown(self):
+        self.threadpool.stop()
+        self.pool.close()
 
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
+        check_required_fields(adapter)
 
-        # Process host data
-        host_name = adapter.get('host_name')
-        host_image = adapter.get('host_image')
-        host_is_superhost = adapter.get('host_is_superhost', False)
-        host_joined = adapter.get('host_joined')
+        if not self.buffer:
+            self.buffer_started = time.monotonic()
+        self.buffer.append(item_row(adapter))
 
-        # Check if host exists
-        self.cursor.execute(
-            "SELECT id FROM listings_host WHERE name = %s",
-            (host_name,)
-        )
-        host_result = self.cursor.fetchone()
-
-        if host_result:
-            host_id = host_result[0]
-        else:
-            # Insert new host
-            self.cursor.execute(
-                """
-                INSERT INTO listings_host (name, image_url, is_superhost, joined_date)
-                VALUES (%s, %s, %s, %s)
-                """,
-                (host_name, host_image, host_is_superhost, host_joined)
-            )
-            self.conn.commit()
-            host_id = self.cursor.lastrowid
-
-        # Process listing data
-        title = adapter.get('title')
-        location = adapter.get('location')
-        address = adapter.get('address')
-        price_per_night = adapter.get('price_per_night')
-        currency = adapter.get('currency', 'USD')
-        total_price = adapter.get('total_price')
-        rating = adapter.get('rating')
-        description = adapter.get('description')
-        reviews_count = adapter.get('reviews_count', 0)
-        property_type = adapter.get('property_type')
-
-        # Check if listing exists
-        self.cursor.execute(
-            "SELECT id FROM listings_listing WHERE title = %s AND location = %s AND host_id = %s",
-            (title, location, host_id)
-        )
-        listing_result = self.cursor.fetchone()
-
-        if listing_result:
-            listing_id = listing_result[0]
-            # Update existing listing
-            self.cursor.execute(
-                """
-                UPDATE listings_listing
-                SET price_per_night = %s, currency = %s, total_price = %s, 
-                    rating = %s, description = %s, reviews_count = %s, 
-                    property_type = %s, updated_at = NOW()
-                WHERE id = %s
-                """,
-                (price_per_night, currency, total_price, rating, description,
-                 reviews_count, property_type, listing_id)
-            )
-        else:
-            # Insert new listing
-            self.cursor.execute(
-                """
-                INSERT INTO listings_listing 
-                (title, location, address, price_per_night, currency, total_price, 
-                 rating, description, reviews_count, property_type, host_id, 
-                 created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """,
-                (title, location, address, price_per_night, currency, total_price,
-                 rating, description, reviews_count, property_type, host_id)
-            )
-            self.conn.commit()
-            listing_id = self.cursor.lastrowid
-
-        # Process images
-        image_urls = adapter.get('image_urls', [])
-
-        # Clear existing images
-        self.cursor.execute(
-            "DELETE FROM listings_listingimage WHERE listing_id = %s",
-            (listing_id,)
-        )
+        if len(self.buffer) >= self.buffer_size or self.buffer_aged():
+            d = self.flush()
+            if d is not None:
+                return d.addCallback(lambda _: item)
+
+        return item
+
+    def buffer_aged(self):
+        # A max age of 0 means no age limit, as for the flush timer
+        if not self.buffer or self.buffer_max_age <= 0:
+            return False
+        return time.monotonic() - self.buffer_started >= self.buffer_max_age
+
+    def flush_on_timer(self):
+        if self.buffer_aged():
+            return self.flush_logged()
 
-        # Insert new images
-        for i, image_url in enumerate(image_urls):
-            is_primary = (i == 0)
-            self.cursor.execute(
-                """
-                INSERT INTO listings_listingimage (listing_id, image_url, is_primary)
-                VALUES (%s, %s, %s)
-                """,
-                (listing_id, image_url, is_primary)
-            )
-
-        # Process amenities
-        amenities = adapter.get('amenities', [])
-
-        # Clear existing listing amenities
-        self.cursor.execute(
-            "DELETE FROM listings_listingamenity WHERE listing_id = %s",
-            (listing_id,)
+    def flush_logged(self):
+        # Flushes not tied to an item have nobody to report failures to
+        d = defer.maybeDeferred(self.flush)
+        d.addErrback(lambda failure: logger.error(
+            'Failed to write buffered items', exc_info=failure_to_exc_info(failure)))
+        return d
+
+    def flush(self):
+        if not self.buffer:
+            return None
+
+        rows, self.buffer = self.buffer, []
+        if not self.threadpool:
+            self.record_flush(self.write_rows(rows), len(rows))
+            return None
+
+        from twisted.internet import reactor
+        d = self.pending_writes.run(
+            threads.deferToThreadPool, reactor, self.threadpool, self.write_rows, rows)
+        d.addCallback(self.record_flush, len(rows))
+        self.in_flight.add(d)
+        d.addBoth(self.write_done, d)
+
+        if self.stats:
+            self.stats.max_value('mysql/pending_writes_max', len(self.in_flight))
+        return d
+
+    def write_done(self, result, d):
+        self.in_flight.discard(d)
+        return result
+
+    def write_rows(self, rows):
+        # Runs on a writer thread in threaded mode, inline otherwise
+        with self.pool.connection() as conn:
+            started = time.perf_counter()
+            writer = write_transaction(conn, rows, self.host_ids, self.amenity_ids,
+                                       self.transaction_retries)
+
+        writer.commit_caches()
+        return writer.stats, time.perf_counter() - started
+
+    def record_flush(self, result, size):
+        counts, elapsed = result
+        if not self.stats:
+            return
+
+        for key, value in counts.items():
+            self.stats.inc_value(key, value)
+        self.stats.inc_value('mysql/flush_count')
+        self.stats.inc_value('mysql/flushed_items', size)
+        self.stats.inc_value('mysql/flush_seconds_total', elapsed)
+        self.stats.max_value('mysql/flush_seconds_max', elapsed)
+        self.stats.max_value('mysql/flush_size_max', size)
+
+
+class SpoolPipeline:
+    """
+    Streams items into local spool segments instead of the database, so the
+    crawl never waits on MySQL. Load the segments with run_loader.py.
+    """
+
+    def __init__(self, spool_dir, segment_items=5000, stats=None):
+        self.spool_dir = spool_dir
+        self.segment_items = segment_items
+        self.stats = stats
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            spool_dir=crawler.settings.get('SPOOL_DIR', 'spool'),
+            segment_items=crawler.settings.getint('SPOOL_SEGMENT_ITEMS', 5000),
+            stats=crawler.stats
         )
 
-        # Insert new amenities
-        for amenity_name in amenities:
-            # Check if amenity exists
-            self.cursor.execute(
-                "SELECT id FROM listings_amenity WHERE name = %s",
-                (amenity_name,)
-            )
-            amenity_result = self.cursor.fetchone()
-
-            if amenity_result:
-                amenity_id = amenity_result[0]
-            else:
-                # Insert new amenity
-                self.cursor.execute(
-                    "INSERT INTO listings_amenity (name) VALUES (%s)",
-                    (amenity_name,)
-                )
-                self.conn.commit()
-                amenity_id = self.cursor.lastrowid
-
-            # Link amenity to listing
-            self.cursor.execute(
-                """
-                INSERT INTO listings_listingamenity (listing_id, amenity_id)
-                VALUES (%s, %s)
-                """,
-                (listing_id, amenity_id)
-            )
-
-        self.conn.commit()
+    def open_spider(self, spider):
+        self.writer = SpoolWriter(
+            self.spool_dir, spider.name, self.segment_items)
+
+    def close_spider(self, spider):
+        self.writer.close()
+        if self.stats:
+            self.stats.set_value('spool/segments', self.writer.sequence)
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        # Checked now rather than at load time, so a bad item is dropped
+        # with the crawl's stats instead of failing its loader batch
+        check_required_fields(adapter)
+
+        self.writer.write(adapter.asdict())
+        if self.stats:
+            self.stats.inc_value('spool/items')
         return item
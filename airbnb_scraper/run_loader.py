@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+from collections import Counter
+
+import mysql.connector
+from scrapy.utils.project import get_project_settings
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from airbnb_scraper.db import LRUCache, item_row, preload_caches, write_transaction  # noqa: E402
+from airbnb_scraper.spool import list_segments, mark_loaded, read_segment  # noqa: E402
+
+
+def write_batch(conn, rows, host_ids, amenity_ids, totals, retries):
+    writer = write_transaction(conn, rows, host_ids, amenity_ids, retries)
+    writer.commit_caches()
+    totals.update(writer.stats)
+    totals['items'] += len(rows)
+
+
+def load_segment(conn, path, batch_size, host_ids, amenity_ids, totals, retries):
+    batch = []
+    for item in read_segment(path):
+        batch.append(item_row(item))
+        if len(batch) >= batch_size:
+            write_batch(conn, batch, host_ids, amenity_ids, totals, retries)
+            batch = []
+
+    if batch:
+        write_batch(conn, batch, host_ids, amenity_ids, totals, retries)
+
+
+def run_loader(spool_dir=None, batch_size=None, replay=False):
+    """
+    Bulk-load spooled items into the listings tables. Writes are upserts
+    keyed on the Airbnb ids and skipped when the content is unchanged, so
+    loading the same segment twice is harmless.
+    """
+    settings = get_project_settings()
+    spool_dir = spool_dir or settings.get('SPOOL_DIR', 'spool')
+    batch_size = batch_size or settings.getint('LOADER_BATCH_SIZE', 1000)
+
+    conn = mysql.connector.connect(
+        host=settings.get('MYSQL_HOST'),
+        port=settings.get('MYSQL_PORT'),
+        user=settings.get('MYSQL_USER'),
+        password=settings.get('MYSQL_PASSWORD'),
+        database=settings.get('MYSQL_DB')
+    )
+    host_ids = LRUCache(settings.getint('MYSQL_HOST_CACHE_SIZE', 10000))
+    amenity_ids = LRUCache(settings.getint('MYSQL_AMENITY_CACHE_SIZE', 2000))
+    # The loader can run next to a live crawl writing the same rows
+    retries = settings.getint('MYSQL_TRANSACTION_RETRIES', 3)
+
+    totals = Counter()
+    started = time.perf_counter()
+    try:
+        cursor = conn.cursor()
+        preload_caches(cursor, host_ids, amenity_ids)
+        cursor.close()
+
+        # Segments are loaded oldest first so later crawls win
+        for path in list_segments(spool_dir, replay=replay):
+            load_segment(conn, path, batch_size, host_ids, amenity_ids, totals,
+                         retries)
+            mark_loaded(path)
+            totals['segments'] += 1
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Loaded {totals['items']} items from {totals['segments']} segments "
+          f"in {elapsed:.1f}s ({totals['items'] / elapsed if elapsed else 0:.0f} items/s), "
+          f"{totals['mysql/items_unchanged']} unchanged")
+    return totals
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Load spooled Airbnb items into the database')
+    parser.add_argument('--spool-dir', type=str,
+                        help='Spool directory (defaults to SPOOL_DIR)')
+    parser.add_argument('--batch-size', type=int,
+                        help='Items per transaction (defaults to LOADER_BATCH_SIZE)')
+    parser.add_argument('--replay', action='store_true',
+                        help='Also reload segments that were already loaded')
+
+    args = parser.parse_args()
+
+    run_loader(
+        spool_dir=args.spool_dir,
+        batch_size=args.batch_size,
+        replay=args.replay
+    )
@@ -1,19 +1,32 @@
+import json
+import multiprocessing
 import os
+import shutil
 import sys
+import tempfile
+import time
 import django
+from collections import Counter
+from functools import partial
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
-from datetime import datetime
+from datetime import date, datetime, timezone
 
 # Set up Django environment
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'airbnb_project.settings')
 django.setup()
 
+from listings.availability import settle_searched_nights  # noqa: E402
 
-def run_spider(location=None, check_in=None, check_out=None, guests=None):
+
+def run_spider(location=None, check_in=None, check_out=None, guests=None,
+               crawl_started=None, settings_overrides=None):
     """
-    Run the Airbnb spider with the given parameters
+    Run the Airbnb spider with the given parameters and return its stats.
+    Without `crawl_started` this is a crawl of its own, and its availability
+    is settled once it has finished; shards of a larger run are settled by
+    run_jobs instead.
     """
     # Format dates if provided
     if check_in and isinstance(check_in, datetime):
@@ -22,41 +35,225 @@ def run_spider(location=None, check_in=None, check_out=None, guests=None):
     if check_out and isinstance(check_out, datetime):
         check_out = check_out.strftime('%Y-%m-%d')
 
+    standalone = crawl_started is None
+    if standalone:
+        crawl_started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
     # Get Scrapy settings
     settings = get_project_settings()
+    for name, value in (settings_overrides or {}).items():
+        settings.set(name, value)
 
     # Create and configure the crawler process
     process = CrawlerProcess(settings)
+    crawler = process.create_crawler('airbnb')
 
     # Add the spider to the process with parameters
     process.crawl(
-        'airbnb',
+        crawler,
         location=location,
         check_in=check_in,
         check_out=check_out,
-        guests=str(guests) if guests else None
+        guests=str(guests) if guests else None,
+        crawl_started=crawl_started
     )
 
     # Start the crawling process
     process.start()
+    stats = crawler.stats.get_stats()
+    if standalone:
+        settle_availability([stats], crawl_started)
+    return stats
+
+
+def completed_search(stats):
+    """
+    (location, check_in, check_out, guests) searched by a crawl that ran to
+    the end, or None. A crawl stopped early, or one that found nothing (as
+    when it is blocked), says nothing about the listings it did not return.
+    """
+    if stats.get('finish_reason') != 'finished' or not stats.get('item_scraped_count'):
+        return None
+    try:
+        return (stats['search/location'], date.fromisoformat(stats['search/check_in']),
+                date.fromisoformat(stats['search/check_out']), int(stats['search/guests']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def settle_availability(shard_stats, crawl_started):
+    """
+    Drop the nights the completed searches of a crawl did not find free,
+    once everything the crawl found has been written. Items spooled rather
+    than written add their nights back when loaded.
+    """
+    searches = [search for search in map(completed_search, shard_stats) if search]
+    if not searches:
+        return 0
+    settled = settle_searched_nights(searches, datetime.fromisoformat(crawl_started))
+    print(f'{settled} availability rows settled for {len(searches)} searches')
+    return settled
+
+
+def job_matrix(locations, windows=None, guest_counts=None):
+    """
+    One crawl job per location, (check_in, check_out) window and guest
+    count; missing dimensions fall back to the spider's defaults.
+    """
+    return [
+        {'location': location, 'check_in': check_in, 'check_out': check_out,
+         'guests': guests}
+        for location in locations or [None]
+        for check_in, check_out in windows or [(None, None)]
+        for guests in guest_counts or [None]
+    ]
+
+
+def run_shard(job, dedupe_db, crawl_started=None):
+    """Pool worker: one job in this process's own reactor."""
+    started = time.perf_counter()
+    try:
+        stats = run_spider(crawl_started=crawl_started,
+                           settings_overrides={'LISTING_DEDUPE_DB': dedupe_db}, **job)
+        error = None
+    except Exception as e:
+        stats, error = {}, f'{type(e).__name__}: {e}'
+    stats['shard/seconds'] = round(time.perf_counter() - started, 3)
+    return job, stats, error
+
+
+def merge_stats(shard_stats):
+    """
+    Combine the stats of several crawls: counters are summed, maxima and
+    time spans widened, finish reasons counted and ratios recomputed.
+    """
+    merged = {}
+    reasons = Counter()
+    for stats in shard_stats:
+        for key, value in stats.items():
+            if key == 'finish_reason':
+                reasons[value] += 1
+            elif isinstance(value, datetime):
+                pick = min if key == 'start_time' else max
+                merged[key] = pick(merged.get(key, value), value)
+            elif isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            elif key.endswith(('_max', '/max')):
+                merged[key] = max(merged.get(key, value), value)
+            elif not key.endswith('_ratio'):
+                merged[key] = merged.get(key, 0) + value
+
+    merged['finish_reasons'] = dict(reasons)
+    results = merged.get('search/results')
+    if results:
+        merged['search/detail_requests_saved_ratio'] = round(
+            merged.get('search/detail_requests_saved', 0) / results, 4)
+    return merged
+
+
+def run_jobs(jobs, workers=4, dedupe_db=None):
+    """
+    Run crawl jobs across a pool of worker processes and return the merged
+    crawl report. Each job gets a fresh process, since a Twisted reactor
+    cannot be restarted. Shards claim listings through a shared SQLite
+    dedupe file, a temporary one unless `dedupe_db` is given.
+    """
+    temp_dir = None
+    if not dedupe_db:
+        temp_dir = tempfile.mkdtemp(prefix='airbnb-dedupe-')
+        dedupe_db = os.path.join(temp_dir, 'listings.sqlite3')
+
+    shards = []
+    started = time.perf_counter()
+    # One crawl as far as availability goes: shards add to each other's nights
+    crawl_started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    try:
+        # spawn: no state of this process (Django, Twisted) leaks into workers
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes=workers, maxtasksperchild=1) as pool:
+            for job, stats, error in pool.imap_unordered(
+                    partial(run_shard, dedupe_db=dedupe_db,
+                            crawl_started=crawl_started), jobs):
+                shards.append({'job': job, 'stats': stats, 'error': error})
+                label = (f"{job['location']} {job['check_in']}..{job['check_out']} "
+                         f"guests={job['guests']}")
+                if error:
+                    print(f'{label}: failed ({error})')
+                else:
+                    print(f"{label}: {stats.get('item_scraped_count', 0)} items "
+                          f"in {stats['shard/seconds']:.0f}s")
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if temp_dir:
+        settle_availability([shard['stats'] for shard in shards if not shard['error']],
+                            crawl_started)
+    else:
+        # Listings claimed by an earlier run were skipped, not found missing
+        print('Availability not settled: the dedupe file is shared with earlier runs')
+
+    report = {
+        'jobs': len(jobs),
+        'failed': sum(1 for shard in shards if shard['error']),
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'stats': merge_stats(shard['stats'] for shard in shards),
+        'shards': shards,
+    }
+    stats = report['stats']
+    print(f"{report['jobs']} jobs ({report['failed']} failed) in {report['wall_seconds']:.0f}s: "
+          f"{stats.get('item_scraped_count', 0)} items, "
+          f"{stats.get('dedupe/listings_skipped', 0)} listing fetches deduplicated")
+    return report
+
+
+def parse_window(value):
+    check_in, sep, check_out = value.partition(':')
+    if not sep:
+        raise ValueError(f'Expected CHECK_IN:CHECK_OUT, got {value!r}')
+    return check_in, check_out
 
 
 if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser(description='Run Airbnb scraper')
-    parser.add_argument('--location', type=str, help='Location to search for')
+    parser.add_argument('--location', type=str, action='append',
+                        help='Location to search for (repeatable)')
+    parser.add_argument('--locations-file', type=str,
+                        help='File with one location per line')
     parser.add_argument('--check-in', type=str,
                         help='Check-in date (YYYY-MM-DD)')
     parser.add_argument('--check-out', type=str,
                         help='Check-out date (YYYY-MM-DD)')
-    parser.add_argument('--guests', type=int, help='Number of guests')
+    parser.add_argument('--window', type=parse_window, action='append',
+                        help='Date window as CHECK_IN:CHECK_OUT (repeatable)')
+    parser.add_argument('--guests', type=int, nargs='+',
+                        help='Number of guests (several values make several jobs)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Worker processes for a sharded run')
+    parser.add_argument('--dedupe-db', type=str,
+                        help='SQLite file shards claim listings through; keep it '
+                             'to skip listings already fetched by an earlier run')
+    parser.add_argument('--report', type=str,
+                        help='Write the merged crawl report to this JSON file')
 
     args = parser.parse_args()
 
-    run_spider(
-        location=args.location,
-        check_in=args.check_in,
-        check_out=args.check_out,
-        guests=args.guests
-    )
+    locations = list(args.location or [])
+    if args.locations_file:
+        with open(args.locations_file, encoding='utf-8') as f:
+            locations += [line.strip() for line in f if line.strip()]
+    windows = list(args.window or [])
+    if args.check_in or args.check_out:
+        windows.append((args.check_in, args.check_out))
+
+    jobs = job_matrix(locations, windows, args.guests)
+    if len(jobs) == 1 and not args.dedupe_db:
+        report = {'stats': run_spider(**jobs[0])}
+    else:
+        report = run_jobs(jobs, workers=args.workers, dedupe_db=args.dedupe_db)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, default=str)
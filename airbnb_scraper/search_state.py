@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+from datetime import date, timedelta
+
+
+def search_fingerprint(fields):
+    """Hash of the search-card fields that hint the detail page changed."""
+    payload = json.dumps([fields.get('title'), fields.get('image_urls')], sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class SearchState:
+    """
+    Remembers, per room id, the search-card fingerprint seen when its detail
+    page was last fetched and when that was. Search-only crawls use it to
+    decide which detail pages are worth fetching again.
+    """
+
+    def __init__(self, path, refresh_days=7):
+        self.path = path
+        self.refresh_days = refresh_days
+        self.rooms = {}
+
+    @classmethod
+    def load(cls, path, refresh_days=7):
+        state = cls(path, refresh_days)
+        try:
+            with open(path, encoding='utf-8') as f:
+                state.rooms = json.load(f)
+        except FileNotFoundError:
+            pass
+        return state
+
+    def needs_detail(self, room_id, fingerprint, today=None):
+        """New rooms, changed cards and stale detail pages are fetched."""
+        known = self.rooms.get(room_id)
+        if known is None:
+            return True
+        seen_fingerprint, fetched_on = known
+        if seen_fingerprint != fingerprint:
+            return True
+        today = today or date.today()
+        return date.fromisoformat(fetched_on) <= today - timedelta(days=self.refresh_days)
+
+    def mark_fetched(self, room_id, fingerprint, today=None):
+        self.rooms[room_id] = [fingerprint, (today or date.today()).isoformat()]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        part_path = self.path + '.part'
+        with open(part_path, 'w', encoding='utf-8') as f:
+            json.dump(self.rooms, f)
+        os.replace(part_path, self.path)
@@ -16,12 +16,22 @@ DOWNLOAD_DELAY = 1
 DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
     'scrapy.downloadermiddlewares.retry.RetryMiddleware': 90,
-    'airbnb_scraper.middlewares.RandomUserAgentMiddleware': 400,
+    'airbnb_scraper.middleware.RandomUserAgentMiddleware': 400,
+    # Only active when LISTING_DEDUPE_DB is set
+    'airbnb_scraper.middleware.ListingDedupeMiddleware': 50,
+}
+
+# Enable or disable spider middlewares
+SPIDER_MIDDLEWARES = {
+    # Before the offsite and depth middlewares see the requests
+    'airbnb_scraper.middleware.CanonicalListingUrlMiddleware': 950,
 }
 
 # Configure item pipelines
+# To crawl without touching the database, replace MySQLPipeline with
+# 'airbnb_scraper.pipeline.SpoolPipeline' and load the spool with run_loader.py
 ITEM_PIPELINES = {
-    'airbnb_scraper.pipelines.MySQLPipeline': 300,
+    'airbnb_scraper.pipeline.MySQLPipeline': 300,
 }
 
 # MySQL Database settings
@@ -31,6 +41,45 @@ MYSQL_USER = 'root'
 MYSQL_PASSWORD = ''
 MYSQL_DB = 'airbnb_db'
 
+# Buffered writes: flush pending items in one transaction once this many are
+# queued or the oldest has waited MYSQL_BUFFER_MAX_AGE seconds (1 = per item)
+MYSQL_BUFFER_SIZE = 1
+MYSQL_BUFFER_MAX_AGE = 5
+
+# Upper bounds for the in-process host and amenity id caches
+MYSQL_HOST_CACHE_SIZE = 10000
+MYSQL_AMENITY_CACHE_SIZE = 2000
+
+# Write batches on this many threads, each with its own pooled connection,
+# instead of on the reactor thread (0 = write inline). At most
+# MYSQL_MAX_PENDING_WRITES batches are queued before items start waiting.
+MYSQL_WRITER_THREADS = 0
+MYSQL_MAX_PENDING_WRITES = 4
+
+# Batches that deadlock or time out waiting for a row lock are rolled back
+# and written again up to this many times before their items fail
+MYSQL_TRANSACTION_RETRIES = 3
+
+# Optional import path of a zero-argument callable returning a DB-API
+# connection, e.g. to point the pipeline at a local MySQL stand-in
+MYSQL_CONNECTION_FACTORY = None
+
+# Spool settings (SpoolPipeline / run_loader.py)
+SPOOL_DIR = 'spool'
+SPOOL_SEGMENT_ITEMS = 5000
+LOADER_BATCH_SIZE = 1000
+
+# Search-only crawls (-a search_only=1): room fingerprints and the date of
+# each room's last detail fetch; detail pages older than
+# SEARCH_DETAIL_REFRESH_DAYS are fetched again even when unchanged
+SEARCH_STATE_FILE = 'search_state.json'
+SEARCH_DETAIL_REFRESH_DAYS = 7
+
+# SQLite file through which concurrent crawls claim listing fetches, so each
+# listing is fetched once per stay across all of them. run_scraper.py sets it
+# for the shards of a sharded run
+LISTING_DEDUPE_DB = None
+
 # Enable and configure HTTP caching
 HTTPCACHE_ENABLED = True
 HTTPCACHE_EXPIRATION_SECS = 86400
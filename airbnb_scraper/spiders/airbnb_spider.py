@@ -1,24 +1,48 @@
-import json
 import scrapy
-import re
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlencode
+from ..extract import (iter_search_results, listing_fields, search_payloads,
+                       search_result_fields)
 from ..items import AirbnbListingItem
+from ..search_state import SearchState, search_fingerprint
 
 
 class AirbnbSpider(scrapy.Spider):
     name = 'airbnb'
     allowed_domains = ['airbnb.com']
 
-    def __init__(self, location=None, check_in=None, check_out=None, guests=None, *args, **kwargs):
+    def __init__(self, location=None, check_in=None, check_out=None, guests=None,
+                 search_only=None, crawl_started=None, *args, **kwargs):
         super(AirbnbSpider, self).__init__(*args, **kwargs)
         self.location = location or 'New York'
         self.check_in = check_in or datetime.now().strftime('%Y-%m-%d')
-        self.check_out = check_out or (datetime.now().replace(
-            day=datetime.now().day + 5)).strftime('%Y-%m-%d')
+        self.check_out = check_out or (
+            datetime.now() + timedelta(days=5)).strftime('%Y-%m-%d')
         self.guests = guests or '2'
+        # Shards of one run share the run's start time, so their availability
+        # adds up and is settled as one crawl
+        self.crawl_started = crawl_started or datetime.now(
+            timezone.utc).isoformat(timespec='seconds')
+        # Build items from the search results' embedded data and only fetch
+        # detail pages of new, changed or stale listings
+        self.search_only = str(search_only).lower() in ('1', 'true', 'yes')
+        self.search_state = None
 
     def start_requests(self):
+        if self.search_only:
+            self.search_state = SearchState.load(
+                self.settings.get('SEARCH_STATE_FILE', 'search_state.json'),
+                self.settings.getint('SEARCH_DETAIL_REFRESH_DAYS', 7))
+
+        # What this crawl searches, for run_scraper to settle availability
+        # against once it has finished
+        stats = self.crawler.stats
+        stats.set_value('search/location', self.location)
+        stats.set_value('search/check_in', self.check_in)
+        stats.set_value('search/check_out', self.check_out)
+        stats.set_value('search/guests', self.guests)
+
         # Construct search URL with parameters
         params = {
             'query': self.location,
@@ -32,15 +56,27 @@ class AirbnbSpider(scrapy.Spider):
         yield scrapy.Request(url=search_url, callback=self.parse_search_results)
 
     def parse_search_results(self, response):
-        # Extract listing URLs from search results
-        listing_links = response.css(
-            'a[data-testid="card-link"]::attr(href)').getall()
-
-        for link in listing_links:
-            if not link.startswith('http'):
-                link = f"https://www.airbnb.com{link}"
-
-            yield scrapy.Request(url=link, callback=self.parse_listing)
+        results = []
+        if self.search_only:
+            started = time.perf_counter()
+            results = [fields for payload in search_payloads(response)
+                       for fields in map(search_result_fields, iter_search_results(payload))
+                       if fields]
+            self.record_parse_time('search', time.perf_counter() - started)
+
+        if results:
+            for fields in results:
+                yield self.from_search_result(fields)
+        else:
+            # Extract listing URLs from search results
+            listing_links = response.css(
+                'a[data-testid="card-link"]::attr(href)').getall()
+
+            for link in listing_links:
+                if not link.startswith('http'):
+                    link = f"https://www.airbnb.com{link}"
+
+                yield scrapy.Request(url=link, callback=self.parse_listing)
 
         # Follow pagination if available
         next_page = response.css('a[aria-label="Next"]::attr(href)').get()
@@ -50,135 +86,69 @@ class AirbnbSpider(scrapy.Spider):
 
             yield scrapy.Request(url=next_page, callback=self.parse_search_results)
 
-    def parse_listing(self, response):
-        # Extract data from the listing page
+    def from_search_result(self, fields):
+        stats = self.crawler.stats
+        stats.inc_value('search/results')
+
+        fingerprint = search_fingerprint(fields)
+        if self.search_state.needs_detail(fields['airbnb_id'], fingerprint):
+            stats.inc_value('search/detail_requests')
+            params = {'check_in': self.check_in, 'check_out': self.check_out,
+                      'adults': self.guests}
+            return scrapy.Request(
+                url=f"https://www.airbnb.com/rooms/{fields['airbnb_id']}?{urlencode(params)}",
+                callback=self.parse_listing,
+                cb_kwargs={'search_fields': fields, 'fingerprint': fingerprint})
+
+        # Known and unchanged: refresh price and rating from the card alone
+        stats.inc_value('search/detail_requests_saved')
+        item = AirbnbListingItem(partial=True, check_in=self.check_in,
+                                 check_out=self.check_out, guests=self.guests,
+                                 crawl_started=self.crawl_started,
+                                 scraped_at=self.scraped_at())
+        for field, value in fields.items():
+            item[field] = value
+        return item
+
+    def closed(self, reason):
+        if self.search_state is None:
+            return
+        self.search_state.save()
+        stats = self.crawler.stats
+        results = stats.get_value('search/results', 0)
+        if results:
+            stats.set_value('search/detail_requests_saved_ratio', round(
+                stats.get_value('search/detail_requests_saved', 0) / results, 4))
+
+    def parse_listing(self, response, search_fields=None, fingerprint=None):
+        started = time.perf_counter()
         item = AirbnbListingItem()
-
-        # Try to extract JSON data from script tags
-        json_data = None
-        for script in response.css('script[type="application/json"]::text').getall():
-            try:
-                data = json.loads(script)
-                if 'data' in data and 'presentation' in data.get('data', {}):
-                    json_data = data
-                    break
-            except:
-                continue
-
-        if json_data:
-            # Extract data from JSON
-            try:
-                listing_data = json_data['data']['presentation']
-                pdp_sections = listing_data.get('pdpSections', {})
-
-                # Basic listing info
-                item['title'] = self.extract_text(
-                    response.css('h1::text').get())
-                item['location'] = self.extract_text(response.css(
-                    'span[data-testid="listing-location"]::text').get())
-                item['address'] = self.extract_text(response.css(
-                    'div[data-testid="listing-address"]::text').get())
-
-                # Price info
-                price_text = response.css(
-                    'span[data-testid="listing-price"] span::text').get()
-                if price_text:
-                    price_match = re.search(r'(\$|€|£)(\d+)', price_text)
-                    if price_match:
-                        item['currency'] = price_match.group(1)
-                        item['price_per_night'] = float(price_match.group(2))
-                    else:
-                        item['currency'] = '$'
-                        item['price_per_night'] = self.extract_price(
-                            price_text)
-
-                # Total price
-                total_price_text = response.css(
-                    'span[data-testid="listing-total-price"]::text').get()
-                item['total_price'] = self.extract_price(
-                    total_price_text) if total_price_text else None
-
-                # Rating and reviews
-                rating_text = response.css(
-                    'span[data-testid="listing-rating"]::text').get()
-                item['rating'] = float(rating_text) if rating_text else None
-
-                reviews_text = response.css(
-                    'span[data-testid="listing-reviews-count"]::text').get()
-                if reviews_text:
-                    reviews_match = re.search(r'(\d+)', reviews_text)
-                    item['reviews_count'] = int(
-                        reviews_match.group(1)) if reviews_match else 0
-
-                # Description
-                item['description'] = self.extract_text(response.css(
-                    'div[data-testid="listing-description"]::text').get())
-
-                # Property type
-                item['property_type'] = self.extract_text(response.css(
-                    'div[data-testid="listing-property-type"]::text').get())
-
-                # Images
-                item['image_urls'] = response.css(
-                    'img[data-testid="listing-image"]::attr(src)').getall()
-
-                # Amenities
-                amenities = response.css(
-                    'div[data-testid="listing-amenities"] div::text').getall()
-                item['amenities'] = [self.extract_text(
-                    amenity) for amenity in amenities if self.extract_text(amenity)]
-
-                # Host information
-                host_section = response.css('div[data-testid="host-profile"]')
-                item['host_name'] = self.extract_text(
-                    host_section.css('h2::text').get())
-                item['host_image'] = host_section.css('img::attr(src)').get()
-
-                superhost_badge = host_section.css(
-                    'div[data-testid="superhost-badge"]')
-                item['host_is_superhost'] = bool(superhost_badge)
-
-                host_joined_text = host_section.css(
-                    'div[data-testid="host-joined-date"]::text').get()
-                if host_joined_text:
-                    joined_match = re.search(
-                        r'Joined in (\w+ \d{4})', host_joined_text)
-                    if joined_match:
-                        try:
-                            item['host_joined'] = datetime.strptime(
-                                joined_match.group(1), '%B %Y').strftime('%Y-%m-%d')
-                        except:
-                            item['host_joined'] = None
-            except Exception as e:
-                self.logger.error(f"Error parsing JSON data: {e}")
-
-        # Fallback to CSS selectors if JSON parsing fails
-        if not item.get('title'):
-            item['title'] = self.extract_text(response.css('h1::text').get())
-
-        if not item.get('location'):
-            item['location'] = self.extract_text(
-                response.css('._9xiloll').get())
-
-        if not item.get('price_per_night'):
-            price_text = response.css('._tyxjp1').get()
-            item['price_per_night'] = self.extract_price(
-                price_text) if price_text else None
-            item['currency'] = '$'  # Default currency
-
-        if not item.get('image_urls'):
-            item['image_urls'] = response.css(
-                '._6tbg2q img::attr(src)').getall()
+        for field, value in listing_fields(response).items():
+            item[field] = value
+        self.record_parse_time('listing', time.perf_counter() - started)
+
+        # Search results only include listings free for the whole stay
+        item['check_in'] = self.check_in
+        item['check_out'] = self.check_out
+        item['guests'] = self.guests
+        item['crawl_started'] = self.crawl_started
+        item['scraped_at'] = self.scraped_at()
+
+        if search_fields:
+            # The search card fills whatever the detail page did not give us
+            for field, value in search_fields.items():
+                if not item.get(field):
+                    item[field] = value
+            self.search_state.mark_fetched(search_fields['airbnb_id'], fingerprint)
 
         yield item
 
-    def extract_text(self, text):
-        if not text:
-            return None
-        return text.strip()
+    def scraped_at(self):
+        return datetime.now(timezone.utc).isoformat(timespec='seconds')
 
-    def extract_price(self, text):
-        if not text:
-            return None
-        price_match = re.search(r'(\d+)', text.replace(',', ''))
-        return float(price_match.group(1)) if price_match else None
+    def record_parse_time(self, page, seconds):
+        """CPU spent extracting one page, summed and maxed per page kind."""
+        stats = self.crawler.stats
+        stats.inc_value(f'parse/{page}_pages')
+        stats.inc_value(f'parse/{page}_seconds_total', round(seconds, 6))
+        stats.max_value(f'parse/{page}_seconds_max', round(seconds, 6))
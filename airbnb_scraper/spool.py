@@ -0,0 +1,87 @@
+import glob
+import gzip
+import json
+import os
+from datetime import datetime
+
+# Finished segments; files still being written carry an extra '.part'
+SEGMENT_SUFFIX = '.ndjson.gz'
+LOADED_DIR = 'loaded'
+
+
+class SpoolWriter:
+    """
+    Appends items as gzip-compressed NDJSON to rotating segment files.
+    A segment only gets its final name once it is complete, so readers
+    never see a half-written file.
+    """
+
+    def __init__(self, spool_dir, prefix, segment_items=5000):
+        self.spool_dir = spool_dir
+        self.prefix = prefix
+        self.segment_items = segment_items
+        self.segment = None
+        self.segment_path = None
+        self.segment_count = 0
+        self.sequence = 0
+        self.started = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def write(self, item):
+        if self.segment is None:
+            self.open_segment()
+
+        self.segment.write(json.dumps(item, default=str, ensure_ascii=False))
+        self.segment.write('\n')
+        self.segment_count += 1
+
+        if self.segment_count >= self.segment_items:
+            self.close_segment()
+
+    def open_segment(self):
+        self.sequence += 1
+        name = f"{self.prefix}-{self.started}-{os.getpid()}-{self.sequence:05d}"
+        self.segment_path = os.path.join(self.spool_dir, name + SEGMENT_SUFFIX)
+        self.segment = gzip.open(
+            self.segment_path + '.part', 'wt', encoding='utf-8')
+        self.segment_count = 0
+
+    def close_segment(self):
+        if self.segment is None:
+            return
+        self.segment.close()
+        os.replace(self.segment_path + '.part', self.segment_path)
+        self.segment = None
+
+    def close(self):
+        self.close_segment()
+
+
+def read_segment(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as segment:
+        for line in segment:
+            if line.strip():
+                yield json.loads(line)
+
+
+def list_segments(spool_dir, replay=False):
+    """
+    Complete segments waiting to be loaded, oldest first. With `replay`,
+    segments that were already loaded are included again.
+    """
+    segments = glob.glob(os.path.join(spool_dir, '*' + SEGMENT_SUFFIX))
+    if replay:
+        segments += glob.glob(
+            os.path.join(spool_dir, LOADED_DIR, '*' + SEGMENT_SUFFIX))
+    return sorted(segments, key=os.path.basename)
+
+
+def mark_loaded(path):
+    # Replayed segments already live in the loaded directory
+    if os.path.basename(os.path.dirname(path)) == LOADED_DIR:
+        return path
+    loaded_dir = os.path.join(os.path.dirname(path), LOADED_DIR)
+    os.makedirs(loaded_dir, exist_ok=True)
+    target = os.path.join(loaded_dir, os.path.basename(path))
+    os.replace(path, target)
+    return target
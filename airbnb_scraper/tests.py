@@ -0,0 +1,320 @@
+import contextlib
+import io
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+
+from scrapy.utils.test import get_crawler
+from twisted.trial import unittest as trial_unittest
+
+from airbnb_scraper.benchmark_parse import run_benchmark
+from airbnb_scraper.db import BatchWriter, LRUCache, item_row
+from airbnb_scraper.pipeline import MySQLPipeline
+
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
+
+# The tables BatchWriter writes, as SQLite; the columns it does not touch
+# are left out
+SCHEMA = """
+CREATE TABLE listings_host (
+    id INTEGER PRIMARY KEY, airbnb_id TEXT UNIQUE, name TEXT NOT NULL,
+    image_url TEXT, is_superhost BOOL, joined_date DATE);
+CREATE TABLE listings_listing (
+    id INTEGER PRIMARY KEY, airbnb_id TEXT UNIQUE, title TEXT NOT NULL,
+    location TEXT NOT NULL, address TEXT, price_per_night REAL NOT NULL,
+    currency TEXT, total_price REAL, rating REAL, description TEXT,
+    reviews_count INT, property_type TEXT, host_id INT NOT NULL, max_guests INT,
+    content_hash TEXT, amenity_bits BLOB, created_at TIMESTAMP,
+    updated_at TIMESTAMP, last_seen_at TIMESTAMP);
+CREATE TABLE listings_listingimage (
+    id INTEGER PRIMARY KEY, listing_id INT, image_url TEXT, is_primary BOOL);
+CREATE TABLE listings_amenity (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE listings_listingamenity (
+    id INTEGER PRIMARY KEY, listing_id INT, amenity_id INT,
+    UNIQUE (listing_id, amenity_id));
+CREATE TABLE listings_listingavailability (
+    id INTEGER PRIMARY KEY, listing_id INT, month DATE, days INT,
+    observed_days INT DEFAULT 0, observed_at TIMESTAMP, updated_at TIMESTAMP,
+    UNIQUE (listing_id, month));
+CREATE TABLE listings_priceobservation (
+    id INTEGER PRIMARY KEY, listing_id INT, observed_on DATE, price_per_night REAL,
+    total_price REAL, rating REAL, currency TEXT, UNIQUE (listing_id, observed_on));
+CREATE TABLE listings_locationstats (
+    id INTEGER PRIMARY KEY, location TEXT UNIQUE, listing_count INT,
+    price_total REAL, rated_count INT, rating_total REAL, superhost_count INT,
+    median_price REAL, p90_price REAL, updated_at TIMESTAMP);
+CREATE TABLE listings_locationpricebucket (
+    id INTEGER PRIMARY KEY, location TEXT, bucket INT, listing_count INT,
+    UNIQUE (location, bucket));
+CREATE TABLE listings_dataversion (id INTEGER PRIMARY KEY, version INT, updated_at TIMESTAMP);
+"""
+# The unique key each ON DUPLICATE KEY UPDATE statement collides on
+UPSERT_KEYS = {
+    'listings_host': 'airbnb_id',
+    'listings_listing': 'airbnb_id',
+    'listings_amenity': 'name',
+    'listings_listingavailability': 'listing_id, month',
+    'listings_priceobservation': 'listing_id, observed_on',
+    'listings_locationstats': 'location',
+    'listings_locationpricebucket': 'location, bucket',
+    'listings_dataversion': 'id',
+}
+UPSERT_RE = re.compile(r'ON DUPLICATE KEY UPDATE')
+INSERT_TABLE_RE = re.compile(r'INSERT INTO (\w+)')
+VALUES_RE = re.compile(r'VALUES\((\w+)\)')
+LOCK_RE = re.compile(r'FOR UPDATE( OF \w+)?')
+
+
+def sqlite_sql(sql):
+    """The MySQL statements BatchWriter issues, rewritten for SQLite."""
+    if UPSERT_RE.search(sql):
+        table = INSERT_TABLE_RE.search(sql).group(1)
+        sql = UPSERT_RE.sub(f'ON CONFLICT ({UPSERT_KEYS[table]}) DO UPDATE SET', sql)
+        sql = VALUES_RE.sub(r'excluded.\1', sql)
+    sql = LOCK_RE.sub('', sql)
+    return sql.replace('GREATEST(', 'MAX(').replace('%s', '?')
+
+
+def sqlite_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+
+class SQLiteCursor:
+    """DB-API cursor taking the MySQL dialect and format-style parameters."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(sqlite_sql(sql), [sqlite_value(value) for value in params])
+
+    def executemany(self, sql, seq_of_params):
+        self.cursor.executemany(sqlite_sql(sql), [
+            [sqlite_value(value) for value in params] for params in seq_of_params])
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    """Stands in for a mysql.connector connection."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                    detect_types=sqlite3.PARSE_DECLTYPES)
+        self.closed = False
+
+    def cursor(self):
+        return SQLiteCursor(self.conn.cursor())
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+        self.closed = True
+
+
+def listing_item(airbnb_id, **fields):
+    item = {
+        'airbnb_id': airbnb_id, 'title': f'Flat {airbnb_id}', 'location': 'Lisbon',
+        'price_per_night': 100.0, 'currency': '€', 'rating': 4.5,
+        'host_airbnb_id': '900', 'host_name': 'Marta',
+        'image_urls': [f'https://img/{airbnb_id}-1.jpg', f'https://img/{airbnb_id}-2.jpg'],
+        'amenities': ['Wifi', 'Kitchen'],
+        'check_in': '2030-01-07', 'check_out': '2030-01-09', 'guests': '2',
+        'crawl_started': '2030-01-01T00:00:00+00:00',
+        'scraped_at': '2030-01-01T00:05:00+00:00',
+    }
+    item.update(fields)
+    return item
+
+
+class SQLiteTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'listings.sqlite3')
+        self.connections = []
+        self.db = self.connect()
+        self.db.conn.executescript(SCHEMA)
+
+    def connect(self):
+        conn = SQLiteConnection(self.path)
+        self.connections.append(conn)
+        self.addCleanup(lambda: conn.closed or conn.close())
+        return conn
+
+    def query(self, sql):
+        return self.db.conn.execute(sql).fetchall()
+
+
+class BatchWriterTests(SQLiteTestCase):
+    def write(self, items):
+        writer = BatchWriter(self.db.cursor(), LRUCache(100), LRUCache(100))
+        writer.write_batch([item_row(item) for item in items])
+        self.db.commit()
+        writer.commit_caches()
+        return writer
+
+    def test_duplicate_items_write_one_listing_with_the_last_copy(self):
+        self.write([
+            listing_item('1', price_per_night=100.0, amenities=['Wifi']),
+            listing_item('2'),
+            listing_item('1', price_per_night=120.0, amenities=['Wifi', 'Washer'],
+                         check_in='2030-01-10', check_out='2030-01-11'),
+        ])
+
+        self.assertEqual(self.query('SELECT COUNT(*) FROM listings_host'), [(1,)])
+        self.assertEqual(
+            self.query('SELECT airbnb_id, price_per_night FROM listings_listing ORDER BY id'),
+            [('1', 120.0), ('2', 100.0)])
+        self.assertEqual(self.query("""
+            SELECT a.name FROM listings_listingamenity la
+            JOIN listings_amenity a ON a.id = la.amenity_id
+            JOIN listings_listing l ON l.id = la.listing_id
+            WHERE l.airbnb_id = '1' ORDER BY a.name"""), [('Washer',), ('Wifi',)])
+        self.assertEqual(self.query("""
+            SELECT COUNT(*) FROM listings_listingimage i
+            JOIN listings_listing l ON l.id = i.listing_id WHERE l.airbnb_id = '1'"""), [(2,)])
+        # Both copies' nights are kept: 7-8 January and 10 January
+        self.assertEqual(self.query("""
+            SELECT a.days FROM listings_listingavailability a
+            JOIN listings_listing l ON l.id = a.listing_id WHERE l.airbnb_id = '1'"""),
+            [(0b1011000000,)])
+        self.assertEqual(self.query(
+            'SELECT listing_count, price_total FROM listings_locationstats'), [(2, 220.0)])
+        self.assertEqual(self.query('SELECT version FROM listings_dataversion'), [(1,)])
+
+    def test_unchanged_listing_is_not_written_again(self):
+        self.write([listing_item('1')])
+        writer = self.write([listing_item('1'), listing_item('1')])
+
+        self.assertEqual(writer.stats['mysql/items_unchanged'], 1)
+        self.assertEqual(writer.stats['mysql/child_rows_inserted'], 0)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM listings_listing'), [(1,)])
+        self.assertEqual(self.query('SELECT listing_count FROM listings_locationstats'), [(1,)])
+        # Same crawl, same nights: nothing to bump the cache version for
+        self.assertEqual(self.query('SELECT version FROM listings_dataversion'), [(1,)])
+
+    def test_search_cards_only_update_stored_listings(self):
+        self.write([listing_item('1')])
+        self.write([
+            {'partial': True, 'airbnb_id': '1', 'price_per_night': 90.0, 'rating': 4.5,
+             'reviews_count': 3, 'crawl_started': '2030-01-01T00:00:00+00:00'},
+            {'partial': True, 'airbnb_id': '2', 'price_per_night': 80.0,
+             'crawl_started': '2030-01-01T00:00:00+00:00'},
+        ])
+
+        self.assertEqual(self.query(
+            'SELECT airbnb_id, price_per_night, reviews_count FROM listings_listing'),
+            [('1', 90.0, 3)])
+        self.assertEqual(self.query('SELECT price_total FROM listings_locationstats'),
+                         [(90.0,)])
+
+
+class MySQLPipelineTests(SQLiteTestCase):
+    def pipeline(self, **kwargs):
+        self.crawler = get_crawler()
+        pipeline = MySQLPipeline(None, None, None, None, None, connection_factory=self.connect,
+                                 stats=self.crawler.stats, **kwargs)
+        pipeline.open_spider(None)
+        return pipeline
+
+    def test_buffer_is_written_once_full(self):
+        pipeline = self.pipeline(buffer_size=2)
+        pipeline.process_item(listing_item('1'), None)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM listings_listing'), [(0,)])
+
+        pipeline.process_item(listing_item('2'), None)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM listings_listing'), [(2,)])
+        self.assertEqual(self.crawler.stats.get_value('mysql/flush_count'), 1)
+        self.assertEqual(self.crawler.stats.get_value('mysql/flushed_items'), 2)
+
+    def test_close_spider_writes_the_rest_of_the_buffer(self):
+        pipeline = self.pipeline(buffer_size=10)
+        for airbnb_id in '123':
+            pipeline.process_item(listing_item(airbnb_id), None)
+
+        self.assertIsNone(pipeline.close_spider(None))
+        self.assertEqual(self.query('SELECT COUNT(*) FROM listings_listing'), [(3,)])
+        self.assertTrue(all(conn.closed for conn in self.connections[1:]))
+
+
+class ThreadedMySQLPipelineTests(trial_unittest.TestCase, SQLiteTestCase):
+    def test_close_spider_waits_for_queued_batches(self):
+        crawler = get_crawler()
+        pipeline = MySQLPipeline(None, None, None, None, None, buffer_size=2,
+                                 writer_threads=2, max_pending_writes=1,
+                                 connection_factory=self.connect, stats=crawler.stats)
+        pipeline.open_spider(None)
+        for airbnb_id in '12345':
+            pipeline.process_item(listing_item(airbnb_id), None)
+        self.assertTrue(pipeline.in_flight)
+
+        def check(_):
+            self.assertFalse(pipeline.in_flight)
+            self.assertEqual(self.query('SELECT COUNT(*) FROM listings_listing'), [(5,)])
+            self.assertEqual(crawler.stats.get_value('mysql/flush_count'), 3)
+            self.assertTrue(all(conn.closed for conn in self.connections[1:]))
+
+        return pipeline.close_spider(None).addCallback(check)
+
+
+class GoldenParseTests(unittest.TestCase):
+    """
+    Saved search and listing pages must extract to their golden outputs;
+    after an intended change, rewrite them with
+    python airbnb_scraper/benchmark_parse.py --pages airbnb_scraper/testdata/pages
+    --golden airbnb_scraper/testdata/golden --write-golden (add --search-only
+    and golden-search-only for the second set). Run from the repository root
+    with python -m unittest airbnb_scraper.tests.
+    """
+
+    def check(self, golden, search_only=False):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            report = run_benchmark(
+                pages_dir=os.path.join(TESTDATA, 'pages'),
+                golden_dir=os.path.join(TESTDATA, golden),
+                repeat=1, search_only=search_only)
+        pages = sum(row['pages'] for kind, row in report.items() if kind != 'golden')
+        self.assertEqual(report.get('golden'), {'ok': pages}, output.getvalue())
+        return report
+
+    def test_pages_match_golden_outputs(self):
+        report = self.check('golden')
+        self.assertEqual(report['search']['pages'], 1)
+        self.assertEqual(report['listing']['pages'], 2)
+
+    def test_search_only_pages_match_golden_outputs(self):
+        self.check('golden-search-only', search_only=True)
+
+
+if __name__ == '__main__':
+    unittest.main()